@@ -0,0 +1,212 @@
+import functools
+import sys
+from collections import Counter
+import events
+
+# ★ pandas/numpy は表を作る時に初めて読む（ライブ集計の Counter 更新だけなら不要）
+
+# ★ 集計に使う列だけを読む（.arrow ならこの列だけ memory-map される）
+COLUMNS = ['set', 'phase', 'setter', 'player', 'skill', 'combo', 'quality',
+           'start_zone', 'end_zone', 'pos1', 'att_phase']
+
+COORDS = ['start_x', 'start_y', 'end_x', 'end_y']
+
+# ★ 文字列列は NaN を "" に、座標列は数値（未入力は NaN）にそろえる
+def clean(df, columns=COLUMNS):
+    import pandas as pd
+    df = df.reindex(columns=columns)
+    text = [c for c in columns if c not in COORDS]
+    out = df[text].where(df[text].notna(), "").astype(str)
+    for c in columns:
+        if c in COORDS:
+            out[c] = pd.to_numeric(df[c], errors='coerce')
+    return out[list(columns)]
+
+# ★ events.point_winner の配列版
+def point_winners(df):
+    import numpy as np
+    import pandas as pd
+    skill, q = df['skill'], df['quality']
+    my = (skill.isin(['A', 'B', 'S']) & (q == '#')) | ((skill == 'A') & (q == 'T'))
+    return pd.Series(np.select([my, q == '^'], ['my', 'op'], ''), index=df.index)
+
+# ★ 選手 × スキル × 評価 の件数
+def player_skill_quality(df):
+    return df.groupby(['player', 'skill', 'quality']).size().unstack('quality', fill_value=0)
+
+# ★ ローテ（pos1の選手）× 局面 の得点率。R局面ならサイドアウト率、S局面ならブレイク率
+#   記録行で終わったラリーだけを数える（My/Op Point ボタンの得点は行が無いので入らない）
+def rotation_phase(df):
+    w = point_winners(df)
+    d = df.assign(won=(w == 'my'), ended=(w != ''))[w != '']
+    g = d.groupby(['pos1', 'phase']).agg(rallies=('ended', 'size'), won=('won', 'sum'))
+    g['pct'] = (g['won'] / g['rallies'] * 100).round(1)
+    return g
+
+# ★ セッター × アタック局面 ごとの配球先（選手）と割合
+def setter_distribution(df):
+    a = df[(df['skill'] == 'A') & (df['setter'] != '')]
+    g = a.groupby(['setter', 'att_phase', 'player']).size().rename('n').to_frame()
+    g['pct'] = (g['n'] / g.groupby(level=[0, 1])['n'].transform('sum') * 100).round(1)
+    return g
+
+# ★ コンビごとの本数・決定率・失点率
+def combo_usage(df):
+    a = df[(df['skill'] == 'A') & (df['combo'] != '')]
+    a = a.assign(kill=a['quality'].isin(['#', 'T']).astype(int), err=(a['quality'] == '^').astype(int))
+    g = a.groupby('combo').agg(n=('quality', 'size'), kill=('kill', 'sum'), err=('err', 'sum'))
+    g['kill_pct'] = (g['kill'] / g['n'] * 100).round(1)
+    g['err_pct'] = (g['err'] / g['n'] * 100).round(1)
+    return g.sort_values('n', ascending=False)
+
+# ★ スキルごとのゾーン別件数（which='start_zone' / 'end_zone'）
+def zone_heatmap(df, skill=None, which='end_zone'):
+    import pandas as pd
+    d = df if skill is None else df[df['skill'] == skill]
+    d = d[d[which] != '']
+    return pd.crosstab(d['skill'], d[which])
+
+# ★ 行が1つ増える/減るたびに O(1) で更新できる集計（試合中のライブ集計用）
+#   各キーの件数を Counter で持ち、表にする時だけ DataFrame にする
+class Aggregates:
+    def __init__(self):
+        self.psq = Counter()      # (player, skill, quality)
+        self.rot = Counter()      # (pos1, phase, 'rallies'/'won')
+        self.setter = Counter()   # (setter, att_phase, player)
+        self.combo = Counter()    # (combo, 'n'/'kill'/'err')
+        self.zone = Counter()     # (skill, end_zone)
+
+    @classmethod
+    def from_frame(cls, df):
+        agg = cls()
+        if len(df) == 0:
+            return agg
+        df = clean(df)
+        agg.psq.update(df.value_counts(['player', 'skill', 'quality']).to_dict())
+        w = point_winners(df)
+        ended = df[w != '']
+        agg.rot.update({k + ('rallies',): v for k, v in ended.value_counts(['pos1', 'phase']).to_dict().items()})
+        agg.rot.update({k + ('won',): v for k, v in df[w == 'my'].value_counts(['pos1', 'phase']).to_dict().items()})
+        a = df[df['skill'] == 'A']
+        agg.setter.update(a[a['setter'] != ''].value_counts(['setter', 'att_phase', 'player']).to_dict())
+        c = a[a['combo'] != '']
+        agg.combo.update({(k, 'n'): v for k, v in c['combo'].value_counts().to_dict().items()})
+        agg.combo.update({(k, 'kill'): v for k, v in c[c['quality'].isin(['#', 'T'])]['combo'].value_counts().to_dict().items()})
+        agg.combo.update({(k, 'err'): v for k, v in c[c['quality'] == '^']['combo'].value_counts().to_dict().items()})
+        agg.zone.update(df[df['end_zone'] != ''].value_counts(['skill', 'end_zone']).to_dict())
+        return agg
+
+    def add(self, row, sign=1):
+        g = lambda k: row.get(k, "") if isinstance(row.get(k, ""), str) else ""
+        skill, quality = g('skill'), g('quality')
+        self.psq[(g('player'), skill, quality)] += sign
+        w = events.point_winner(skill, quality)
+        if w:
+            self.rot[(g('pos1'), g('phase'), 'rallies')] += sign
+            if w == 'my': self.rot[(g('pos1'), g('phase'), 'won')] += sign
+        if skill == 'A':
+            if g('setter'): self.setter[(g('setter'), g('att_phase'), g('player'))] += sign
+            if g('combo'):
+                self.combo[(g('combo'), 'n')] += sign
+                if quality in ('#', 'T'): self.combo[(g('combo'), 'kill')] += sign
+                if quality == '^': self.combo[(g('combo'), 'err')] += sign
+        if g('end_zone'): self.zone[(skill, g('end_zone'))] += sign
+
+    def remove(self, row):
+        self.add(row, -1)
+
+    def merge(self, other):
+        for name in ('psq', 'rot', 'setter', 'combo', 'zone'):
+            getattr(self, name).update(getattr(other, name))
+        return self
+
+    def player_skill_quality(self):
+        import pandas as pd
+        s = pd.Series({k: v for k, v in self.psq.items() if v}, dtype='int64')
+        if s.empty: return pd.DataFrame()
+        s.index.names = ['player', 'skill', 'quality']
+        return s.unstack('quality', fill_value=0)
+
+    def rotation_phase(self):
+        import pandas as pd
+        keys = {k[:2] for k, v in self.rot.items() if v}
+        g = pd.DataFrame([(p, ph, self.rot[(p, ph, 'rallies')], self.rot[(p, ph, 'won')]) for p, ph in sorted(keys)],
+                         columns=['pos1', 'phase', 'rallies', 'won']).set_index(['pos1', 'phase'])
+        g['pct'] = (g['won'] / g['rallies'].where(g['rallies'] > 0) * 100).round(1)
+        return g
+
+    def setter_distribution(self):
+        import pandas as pd
+        s = pd.Series({k: v for k, v in self.setter.items() if v}, dtype='int64')
+        if s.empty: return pd.DataFrame()
+        s.index.names = ['setter', 'att_phase', 'player']
+        g = s.sort_index().rename('n').to_frame()
+        g['pct'] = (g['n'] / g.groupby(level=[0, 1])['n'].transform('sum') * 100).round(1)
+        return g
+
+    def zone_heatmap(self):
+        import pandas as pd
+        s = pd.Series({k: v for k, v in self.zone.items() if v}, dtype='int64')
+        if s.empty: return pd.DataFrame()
+        s.index.names = ['skill', 'end_zone']
+        return s.unstack('end_zone', fill_value=0)
+
+    def combo_usage(self):
+        import pandas as pd
+        names = sorted({k[0] for k, v in self.combo.items() if v}, key=lambda c: -self.combo[(c, 'n')])
+        g = pd.DataFrame([(c, self.combo[(c, 'n')], self.combo[(c, 'kill')], self.combo[(c, 'err')]) for c in names],
+                         columns=['combo', 'n', 'kill', 'err']).set_index('combo')
+        g['kill_pct'] = (g['kill'] / g['n'] * 100).round(1)
+        g['err_pct'] = (g['err'] / g['n'] * 100).round(1)
+        return g
+
+# ★ 保存済み全試合の集計。試合ごとの集計は 索引の更新時刻 + ジャーナルの seq をキーにキャッシュし、変わった試合だけ読み直す
+#   seq も見るのは zones.py の再判定（rewrite_rows）が索引の更新時刻を変えないため
+@functools.lru_cache(maxsize=1024)
+def _game_aggregates(game_id, updated, seq):
+    import storage
+    loaded = storage.Journal(game_id).load(claim=False, columns=COLUMNS)
+    if loaded is None:
+        return Aggregates()
+    return Aggregates.from_frame(storage.match_log(loaded[1].get("sets", []), loaded[0], COLUMNS).frame())
+
+def season_aggregates(game_ids=None):
+    import game_index
+    import storage
+    game_index.ensure_index()
+    games = game_index.list_games(page_size=-1)
+    total = Aggregates()
+    for gid, _, _, _, updated in games:
+        if game_ids is None or gid in game_ids:
+            total.merge(_game_aggregates(gid, updated, storage.head_seq(gid)))
+    return total
+
+def load_frames(game_ids=None, columns=COLUMNS):
+    import pandas as pd
+    import game_index
+    import storage
+    game_index.ensure_index()
+    frames = []
+    for gid, *_ in game_index.list_games(page_size=-1):
+        if game_ids is None or gid in game_ids:
+            loaded = storage.Journal(gid).load(claim=False, columns=columns)
+            if loaded is None:
+                continue
+            log = storage.match_log(loaded[1].get("sets", []), loaded[0], columns)
+            if len(log):
+                frames.append(clean(log.frame(), columns).assign(game_id=gid))
+    return pd.concat(frames, ignore_index=True) if frames else clean(pd.DataFrame(), columns)
+
+# ★ シーズン集計を表示する（python analytics.py [ID ...]）。試合ごとの集計を足し合わせるだけで全行の groupby はしない
+if __name__ == "__main__":
+    import pandas as pd
+    agg = season_aggregates(set(sys.argv[1:]) or None)
+    pd.set_option('display.width', 200)
+    for title, table in [("Player x Skill x Quality", agg.player_skill_quality()),
+                         ("Rotation x Phase", agg.rotation_phase()),
+                         ("Setter distribution", agg.setter_distribution()),
+                         ("Combo usage", agg.combo_usage()),
+                         ("End zones", agg.zone_heatmap())]:
+        print(f"== {title} ==")
+        print(table.to_string() if len(table) else "(no data)")
+        print()
@@ -1,638 +1,870 @@
-import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from streamlit_image_coordinates import streamlit_image_coordinates
-import io
-from PIL import Image
-import json
-import os
-import glob
-import re
-import copy
-
-st.set_page_config(page_title="Volleyball Scouter Ver.9.10", layout="wide")
-
-st.markdown("""
-<style>
-    .block-container { padding-top: 4rem; padding-bottom: 6rem; }
-    
-    /* カラム間・縦積みの隙間を詰める */
-    div[data-testid="stHorizontalBlock"] { gap: 4px !important; }
-    div[data-testid="stVerticalBlock"] { gap: 4px !important; }
-
-    /* ボタンの高さ・文字だけ指定（幅は use_container_width に任せる） */
-    div[data-testid="stButton"] button {
-        height: 80px !important;
-        font-weight: 900 !important;
-        font-size: 24px !important;
-        border-radius: 6px !important;
-        touch-action: manipulation;
-    }
-
-    .keypad-btn > button { height: 80px !important; font-size: 32px !important; }
-    
-    div.stDownloadButton > button {
-        background-color: #FF4B4B; color: white; height: 80px; font-size: 24px;
-        border: 2px solid white; box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-    }
-    .score-board { font-size: 40px; font-weight: 900; text-align: center; background: #333; color: white; padding: 5px; border-radius: 8px; }
-    .input-card { background-color: #f8f9fa; padding: 10px; border-radius: 15px; border: 2px solid #e9ecef; }
-    .step-header { font-size: 20px; font-weight: bold; color: #4c78a8; margin-bottom: 5px; border-bottom: 2px solid #4c78a8; }
-    .rot-grid { display: grid; grid-template-columns: 1fr 1fr 1fr; gap: 4px; text-align: center; font-weight: bold; font-size: 14px; }
-    .rot-cell { border: 1px solid #555; padding: 8px; background: white; border-radius: 6px; }
-    .rot-front { background: #ffebeb; }
-    .rot-server { border: 3px solid red; color: red; font-weight: 900; }
-</style>
-""", unsafe_allow_html=True)
-
-defaults = {
-    'game_id': '',
-    'stage': 0, 'roster_cursor': 0, 'temp_roster': [], 'scout_step': 0,
-    'set_name': '1', 'video_url': '', 'liberos': [], 'rotation': [], 'score': [0, 0], 'phase': 'R',
-    'current_input_data': {}, 'data_log': [], 'points': [], 
-    'setter_counts': {}, 'player_counts': {}, 'all_players': [],
-    'key_map': 0, 'time_buffer': "", 'key_roster': 0, 'history_stack': [], 'custom_combo_pool': {},
-}
-for k, v in defaults.items():
-    if k not in st.session_state: st.session_state[k] = v
-
-FIXED_COMBOS_TOP = ['V5', 'X5', 'VC', 'XC']
-FIXED_COMBOS_MID = ['Q1', 'Q3', 'B1', 'BC']
-ALL_FIXED_COMBOS = FIXED_COMBOS_TOP + FIXED_COMBOS_MID
-
-# ★ ID別のファイル名を返す（複数人が同時に別IDで作業できる）
-def data_file():
-    return f"autosave_data_{st.session_state.game_id}.csv"
-
-def state_file():
-    return f"autosave_state_{st.session_state.game_id}.json"
-
-# ★ ゲーム関連のセッション状態をデフォルトに戻す（game_id以外）
-def reset_session():
-    for k, v in defaults.items():
-        if k == 'game_id':
-            continue
-        st.session_state[k] = copy.deepcopy(v)
-
-# ★ 現在のIDの保存ファイルがあれば読み込む。成功でTrue
-def load_game():
-    sf = state_file()
-    if not os.path.exists(sf):
-        return False
-    if os.path.exists(data_file()):
-        df = pd.read_csv(data_file())
-        st.session_state.data_log = df.to_dict('records')
-    with open(sf, 'r') as f:
-        d = json.load(f)
-    st.session_state.score = d["score"]; st.session_state.rotation = d["rotation"]
-    st.session_state.phase = d["phase"]; st.session_state.set_name = d["set_name"]
-    st.session_state.video_url = d["video_url"]; st.session_state.liberos = d["liberos"]
-    st.session_state.setter_counts = d.get("setter_counts", {})
-    st.session_state.player_counts = d.get("player_counts", {})
-    st.session_state.all_players = d.get("all_players", [p for p in d["rotation"] + d["liberos"] if p])
-    st.session_state.custom_combo_pool = d.get("custom_combo_pool", {})
-    st.session_state.stage = 6
-    return True
-
-def save_state_to_history():
-    state_snapshot = {
-        'score': copy.deepcopy(st.session_state.score),
-        'rotation': copy.deepcopy(st.session_state.rotation),
-        'phase': st.session_state.phase,
-        'setter_counts': copy.deepcopy(st.session_state.setter_counts),
-        'player_counts': copy.deepcopy(st.session_state.player_counts),
-        'custom_combo_pool': copy.deepcopy(st.session_state.custom_combo_pool)
-    }
-    st.session_state.history_stack.append(state_snapshot)
-    if len(st.session_state.history_stack) > 10: st.session_state.history_stack.pop(0)
-
-def undo_last_action():
-    if not st.session_state.data_log:
-        st.warning("No data to delete")
-        return
-    st.session_state.data_log.pop()
-    if st.session_state.history_stack:
-        prev = st.session_state.history_stack.pop()
-        st.session_state.score = prev['score']
-        st.session_state.rotation = prev['rotation']
-        st.session_state.phase = prev['phase']
-        st.session_state.setter_counts = prev['setter_counts']
-        st.session_state.player_counts = prev['player_counts']
-        st.session_state.custom_combo_pool = prev['custom_combo_pool']
-        st.toast("Undo Successful", icon="↩️")
-    auto_save()
-    st.rerun()
-
-def auto_save():
-    if not st.session_state.game_id:
-        return  # IDが未設定なら保存しない
-    if len(st.session_state.data_log) > 0:
-        pd.DataFrame(st.session_state.data_log).to_csv(data_file(), index=False)
-    state_data = {
-        "score": st.session_state.score, "rotation": st.session_state.rotation, "phase": st.session_state.phase,
-        "set_name": st.session_state.set_name, "video_url": st.session_state.video_url, "liberos": st.session_state.liberos,
-        "setter_counts": st.session_state.setter_counts, "player_counts": st.session_state.player_counts,
-        "all_players": st.session_state.all_players,
-        "custom_combo_pool": st.session_state.custom_combo_pool, "stage": st.session_state.stage
-    }
-    with open(state_file(), 'w') as f: json.dump(state_data, f)
-
-def coords_to_zone(lx, ly):
-    if lx < 0 or lx > 9 or ly < 0 or ly > 18: return "Out"
-    r = int(min(max(ly, 0), 17.99) // 3)
-    c = int(min(max(lx, 0), 8.99) // 3)
-    if r < 3: return str([[5,6,1], [7,8,9], [4,3,2]][r][c])
-    else: return str([[2,3,4], [1,6,5]][0 if ly < 13.5 else 1][c])
-
-def create_court_img(points):
-    fig, ax = plt.subplots(figsize=(3.75, 6))
-    ax.add_patch(patches.Rectangle((-3, -3), 15, 24, fc='#e0e0e0', ec='none'))
-    ax.add_patch(patches.Rectangle((0, 0), 9, 18, fc='#FFCC99', ec='black', lw=2))
-    ax.plot([3,3], [0,18], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
-    ax.plot([6,6], [0,18], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
-    ax.plot([0,9], [3,3], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
-    ax.plot([0,9], [15,15], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
-    ax.plot([0,9], [9,9], c='red', lw=3, zorder=2)
-    ax.plot([0,9], [6,6], c='black', lw=2, zorder=2)
-    ax.plot([0,9], [12,12], c='black', lw=2, zorder=2)
-    ax.plot([-3,-3,12,12,-3], [-3,21,21,-3,-3], c='black', lw=2)
-    # 始点→終点の矢印を先に描く（マーカーの下になるように）
-    if len(points) >= 2:
-        sx, sy = points[0][2], points[0][3]
-        ex, ey = points[1][2], points[1][3]
-        ax.annotate("", xy=(ex, ey), xytext=(sx, sy),
-                    arrowprops=dict(arrowstyle="-|>", color='gray', alpha=0.6, lw=2),
-                    zorder=5)
-
-    for i, p in enumerate(points):
-        lx, ly = p[2], p[3]
-        col = "blue" if i==0 else "red"
-        lbl = "S" if i==0 else "E"
-        ax.scatter(lx, ly, s=150, c=col, zorder=10, edgecolors='white')
-        ax.text(lx, ly, lbl, color='white', ha='center', va='center', fontweight='bold', fontsize=8, zorder=11)
-    ax.set_xlim(-3, 12); ax.set_ylim(-3, 21); ax.axis('off')
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0)
-    buf.seek(0)
-    return Image.open(buf)
-
-def format_time(val):
-    s = str(val).strip()
-    if len(s) == 0: return "00:00"
-    v = int(s)
-    if len(s) <= 2: return f"00:{v:02d}"
-    sec = int(s[-2:]); min_ = int(s[:-2])
-    return f"{min_:02d}:{sec:02d}"
-
-def time_to_sec(t_str):
-    if ':' not in t_str: return 0
-    m, s = t_str.split(':')
-    return int(m)*60 + int(s)
-
-def rotate_team():
-    r = st.session_state.rotation
-    st.session_state.rotation = [r[-1]] + r[:-1]
-    auto_save()
-
-def update_score(winner):
-    if winner == 'my':
-        st.session_state.score[0] += 1
-        if st.session_state.phase == 'R':
-            rotate_team()
-            st.toast("Sideout!", icon="⭕")
-        else:
-            st.toast("Break!", icon="⭕")
-        st.session_state.phase = 'S'
-    elif winner == 'op':
-        st.session_state.score[1] += 1
-        st.session_state.phase = 'R'
-        st.toast("Op Point", icon="❌")
-    auto_save()
-
-def count_setter_usage(name):
-    if name and name not in ("ダイレクト", "ツー"):
-        st.session_state.setter_counts[name] = st.session_state.setter_counts.get(name, 0) + 1
-
-def count_custom_combo(combo):
-    if combo and combo not in ALL_FIXED_COMBOS:
-        st.session_state.custom_combo_pool[combo] = st.session_state.custom_combo_pool.get(combo, 0) + 1
-
-def commit_record(quality, winner=None):
-    save_state_to_history()
-    curr = st.session_state.current_input_data
-    if curr.get('skill') == 'A':
-        count_custom_combo(curr.get('combo', ''))
-    s_z, e_z = "", ""
-    s_x, s_y, e_x, e_y = "", "", "", ""
-    if len(st.session_state.points) >= 1: 
-        s_x, s_y = st.session_state.points[0][2], st.session_state.points[0][3]
-        s_z = coords_to_zone(s_x, s_y)
-    if len(st.session_state.points) >= 2: 
-        e_x, e_y = st.session_state.points[1][2], st.session_state.points[1][3]
-        e_z = coords_to_zone(e_x, e_y)
-    is_bottom_to_top = False
-    if s_y != "" and e_y != "":
-        if s_y < e_y and s_y < 9: is_bottom_to_top = True
-    elif s_y != "" and e_y == "":
-        if s_y < 9: is_bottom_to_top = True
-    if is_bottom_to_top:
-        s_x = 9.0 - s_x; s_y = 18.0 - s_y; s_z = coords_to_zone(s_x, s_y)
-        if e_x != "":
-            e_x = 9.0 - e_x; e_y = 18.0 - e_y; e_z = coords_to_zone(e_x, e_y)
-    final_row = {
-        "set": st.session_state.set_name,
-        "score": f"{st.session_state.score[0]}-{st.session_state.score[1]}",
-        "phase": st.session_state.phase,
-        "setter": curr.get('setter',''), "player": curr.get('player',''),
-        "skill": curr.get('skill',''), "combo": curr.get('combo',''),
-        "quality": quality,
-        "start_zone": s_z, "end_zone": e_z,
-        "start_x": s_x, "start_y": s_y, "end_x": e_x, "end_y": e_y,
-        "memo": "", "video_url": st.session_state.video_url,
-        "video_time": time_to_sec(curr.get('time',''))
-    }
-    # ★ その時点のローテにおけるポジション1〜6の選手名を右端に追加（回転前に取得）
-    final_row.update(get_positions())
-    # ★ アタック局面（レセプR/トランジションT/チャンスC）を最右列に追加。アタック以外は空。
-    final_row["att_phase"] = curr.get('att_phase', '') if curr.get('skill') == 'A' else ''
-    st.session_state.data_log.append(final_row)
-    if winner: update_score(winner)
-    else:
-        skill = curr.get('skill','')
-        if (skill in ['A','B','S'] and quality=='#') or (skill=='A' and quality=='T'): update_score('my')
-        elif quality == '^': update_score('op')
-        else: st.toast("Saved", icon="✅")
-    st.session_state.points = []
-    st.session_state.current_input_data = {}
-    st.session_state.scout_step = 0
-    st.session_state.key_map += 1
-    st.session_state.time_buffer = "" 
-    auto_save()
-    st.rerun()
-
-def get_sorted_players():
-    return sorted(st.session_state.all_players, key=lambda n: st.session_state.player_counts.get(n, 0), reverse=True)
-
-def get_sorted_setters():
-    return sorted(st.session_state.all_players, key=lambda n: st.session_state.setter_counts.get(n, 0), reverse=True) + ["ダイレクト"]
-
-def get_custom_combos():
-    sorted_c = sorted(st.session_state.custom_combo_pool.items(), key=lambda x: x[1], reverse=True)
-    return [x[0] for x in sorted_c]
-
-# ★ コンビ入力(step5)が必要か: スパイク かつ セッター経由(ダイレクト/ツーでない)
-def needs_combo():
-    curr = st.session_state.current_input_data
-    if curr.get('skill') != 'A':
-        return False
-    if curr.get('setter', '') == '':       # ダイレクト（セッター空）
-        return False
-    if curr.get('combo', '') == 'ツー':     # ツー（comboは既に確定済み）
-        return False
-    return True
-
-# ★ 現ローテにおける各ポジション(1〜6)の選手名を返す
-def get_positions():
-    r = st.session_state.rotation
-    if len(r) < 6:
-        return {f"pos{i}": "" for i in range(1, 7)}
-    # 配列index → コートポジション: r[0]=P1, r[5]=P2, r[4]=P3, r[3]=P4, r[2]=P5, r[1]=P6
-    return {
-        "pos1": r[0], "pos2": r[5], "pos3": r[4],
-        "pos4": r[3], "pos5": r[2], "pos6": r[1],
-    }
-
-# ==========================================
-# 3. アプリ進行フロー
-# ==========================================
-with st.sidebar:
-    st.header("🔑 解析ID")
-    if st.session_state.game_id:
-        st.success(f"現在のID: **{st.session_state.game_id}**")
-        st.caption("このIDに紐づくデータが随時保存されます")
-        if st.button("🔄 ID変更 / 別の試合へ", use_container_width=True):
-            reset_session()
-            st.session_state.game_id = ''
-            st.rerun()
-    else:
-        st.caption("最初にIDを入力してください")
-
-# ★ IDゲート: game_idが未設定なら、ID入力画面を表示してここで止める
-if not st.session_state.game_id:
-    st.title("🔑 解析IDを入力")
-    st.caption("5桁の数字IDを入力してください。複数人で解析する場合は各自で別のIDを使います。")
-    id_val = st.text_input("ID (5桁)", max_chars=5, placeholder="例: 12345")
-    if st.button("▶️ 開始 / 再開", use_container_width=True):
-        if len(id_val) == 5 and id_val.isdigit():
-            st.session_state.game_id = id_val
-            if load_game():
-                st.toast("続きから再開しました", icon="📂")
-            else:
-                st.session_state.stage = 0  # 新規セットアップ
-                st.toast("新しい試合を開始します", icon="🆕")
-            st.rerun()
-        else:
-            st.error("5桁の数字を入力してください")
-
-    # 既存の保存データをワンタップで再開
-    existing = sorted(glob.glob("autosave_state_*.json"))
-    saved_ids = [os.path.basename(p)[len("autosave_state_"):-len(".json")] for p in existing]
-    if saved_ids:
-        st.markdown("---")
-        st.subheader("保存済みデータから再開")
-        cols = st.columns(3)
-        for i, sid in enumerate(saved_ids):
-            if cols[i % 3].button(f"ID {sid}", key=f"resume_{sid}", use_container_width=True):
-                st.session_state.game_id = sid
-                load_game()
-                st.toast(f"ID {sid} を再開", icon="📂")
-                st.rerun()
-    st.stop()
-
-if st.session_state.stage < 6:
-    st.title("🛠️ Game Setup")
-    if st.session_state.stage == 0:
-        st.subheader("Step 1: Set Number")
-        val = st.text_input("Set", value="1")
-        if st.button("Next", use_container_width=True): st.session_state.set_name = val; st.session_state.stage = 1; auto_save(); st.rerun()
-    elif st.session_state.stage == 1:
-        st.subheader("Step 2: Video URL")
-        val = st.text_input("URL", value="")
-        if st.button("Next", use_container_width=True): st.session_state.video_url = val; st.session_state.stage = 2; auto_save(); st.rerun()
-    elif st.session_state.stage == 2:
-        idx = st.session_state.roster_cursor
-        pos_names = ["1 (Server)", "6 (Back-C)", "5 (Back-L)", "4 (Front-L)", "3 (Front-C)", "2 (Front-R)"]
-        st.subheader(f"Step 3: Lineup ({idx+1}/6)")
-        st.info(f"Position: **{pos_names[idx]}**")
-        k = f"roster_{idx}_{st.session_state.key_roster}"
-        p_name = st.text_input("Player Name", key=k)
-        if st.button("Add Player", use_container_width=True):
-            if p_name:
-                st.session_state.temp_roster.append(p_name)
-                st.session_state.key_roster += 1
-                if st.session_state.roster_cursor < 5: st.session_state.roster_cursor += 1
-                else: st.session_state.stage = 3
-                st.rerun()
-    elif st.session_state.stage == 3:
-        st.subheader("Step 4: Confirm")
-        r = st.session_state.temp_roster
-        st.markdown(f"""<div class="rot-grid"><div class="rot-cell rot-front">④ {r[3]}</div><div class="rot-cell rot-front">③ {r[4]}</div><div class="rot-cell rot-front">② {r[5]}</div><div class="rot-cell">⑤ {r[2]}</div><div class="rot-cell">⑥ {r[1]}</div><div class="rot-cell rot-server">① {r[0]}</div></div>""", unsafe_allow_html=True)
-        c1, c2 = st.columns(2)
-        if c1.button("OK", use_container_width=True): st.session_state.rotation = st.session_state.temp_roster; st.session_state.stage = 4; auto_save(); st.rerun()
-        if c2.button("Retry", use_container_width=True): st.session_state.stage = 2; st.session_state.roster_cursor = 0; st.session_state.temp_roster = []; st.rerun()
-    elif st.session_state.stage == 4:
-        st.subheader("Step 5: Liberos")
-        val = st.text_input("Names (comma separated)")
-        if st.button("Next", use_container_width=True): st.session_state.liberos = [x.strip() for x in val.split(',')] if val else []; st.session_state.stage = 5; auto_save(); st.rerun()
-    elif st.session_state.stage == 5:
-        st.subheader("Step 6: First Phase")
-        c1, c2 = st.columns(2)
-        if c1.button("Serve (We)", use_container_width=True): 
-            st.session_state.all_players = [p for p in st.session_state.rotation + st.session_state.liberos if p]
-            st.session_state.phase = 'S'; st.session_state.stage = 6; auto_save(); st.rerun()
-        if c2.button("Reception (Op)", use_container_width=True): 
-            st.session_state.all_players = [p for p in st.session_state.rotation + st.session_state.liberos if p]
-            st.session_state.phase = 'R'; st.session_state.stage = 6; auto_save(); st.rerun()
-
-elif st.session_state.stage == 6:
-    c_score, c_rot = st.columns([1.3, 1.0]) 
-    with c_score:
-        st.markdown(f'<div class="score-board">{st.session_state.score[0]}-{st.session_state.score[1]} ({st.session_state.phase})</div>', unsafe_allow_html=True)
-        b1, b2 = st.columns(2)
-        if b1.button("My Point (+1)", use_container_width=True): save_state_to_history(); update_score('my'); auto_save(); st.rerun()
-        if b2.button("Op Point (+1)", use_container_width=True): save_state_to_history(); update_score('op'); auto_save(); st.rerun()
-    with c_rot:
-        r = st.session_state.rotation
-        st.markdown(f"""<div class="rot-grid"><div class="rot-cell rot-front">④ {r[3]}</div><div class="rot-cell rot-front">③ {r[4]}</div><div class="rot-cell rot-front">② {r[5]}</div><div class="rot-cell">⑤ {r[2]}</div><div class="rot-cell">⑥ {r[1]}</div><div class="rot-cell rot-server">① {r[0]}</div></div>""", unsafe_allow_html=True)
-
-    st.divider()
-    
-    col_map, col_card = st.columns([1.3, 1.0])
-    
-    with col_map:
-        st.markdown("**MAP (タップで着地点を記録)**")
-        court_img = create_court_img(st.session_state.points)
-        val = streamlit_image_coordinates(court_img, key=f"main_court_{st.session_state.key_map}", width=450, height=720)
-        if val:
-            px, py = val['x'], val['y']
-            lx = -3 + (px / 450) * 15
-            ly = 21 - (py / 720) * 24
-            p = (px, py, lx, ly)
-            if not st.session_state.points or st.session_state.points[-1][:2] != (px, py):
-                if len(st.session_state.points) < 2:
-                    st.session_state.points.append(p)
-                    if len(st.session_state.points) == 2 and st.session_state.scout_step == 4:
-                        st.session_state.scout_step = 5 if needs_combo() else 6
-                    st.rerun()
-                else:
-                    st.session_state.points = [p]; st.rerun()
-        msg = "Start" if len(st.session_state.points)==0 else ("End" if len(st.session_state.points)==1 else "Done")
-        st.caption(f"Tap: {msg}")
-
-    with col_card:
-        st.markdown('<div class="input-card">', unsafe_allow_html=True)
-        
-        if st.session_state.scout_step == 0:
-            st.markdown('<div class="step-header">1. Time</div>', unsafe_allow_html=True)
-            disp_time = format_time(st.session_state.time_buffer)
-            st.markdown(f"<h1 style='text-align:center; font-size:60px; margin:0;'>{disp_time}</h1>", unsafe_allow_html=True)
-            with st.container():
-                k1, k2, k3 = st.columns(3)
-                with k1: 
-                    if st.button("7", key="k7", use_container_width=True): st.session_state.time_buffer += "7"; st.rerun()
-                with k2: 
-                    if st.button("8", key="k8", use_container_width=True): st.session_state.time_buffer += "8"; st.rerun()
-                with k3: 
-                    if st.button("9", key="k9", use_container_width=True): st.session_state.time_buffer += "9"; st.rerun()
-                k4, k5, k6 = st.columns(3)
-                with k4: 
-                    if st.button("4", key="k4", use_container_width=True): st.session_state.time_buffer += "4"; st.rerun()
-                with k5: 
-                    if st.button("5", key="k5", use_container_width=True): st.session_state.time_buffer += "5"; st.rerun()
-                with k6: 
-                    if st.button("6", key="k6", use_container_width=True): st.session_state.time_buffer += "6"; st.rerun()
-                k7, k8, k9 = st.columns(3)
-                with k7: 
-                    if st.button("1", key="k1", use_container_width=True): st.session_state.time_buffer += "1"; st.rerun()
-                with k8: 
-                    if st.button("2", key="k2", use_container_width=True): st.session_state.time_buffer += "2"; st.rerun()
-                with k9: 
-                    if st.button("3", key="k3", use_container_width=True): st.session_state.time_buffer += "3"; st.rerun()
-                k0, kc, ke = st.columns(3)
-                with k0: 
-                    if st.button("0", key="k0", use_container_width=True): st.session_state.time_buffer += "0"; st.rerun()
-                with kc: 
-                    if st.button("C", key="kclr", use_container_width=True): st.session_state.time_buffer = ""; st.rerun()
-                with ke: 
-                    if st.button("⏎", key="kent", type="primary", use_container_width=True):
-                        st.session_state.current_input_data['time'] = disp_time
-                        st.session_state.scout_step = 1; st.rerun()
-
-        elif st.session_state.scout_step == 1:
-            st.markdown('<div class="step-header">2. Skill</div>', unsafe_allow_html=True)
-            skills_jp = [("S", "サーブ"), ("R", "レセプション"), ("A", "スパイク"), ("B", "ブロック"), ("D", "ディグ"), ("E", "セット")]
-            s_cols = st.columns(2)
-            for i, (sk, label) in enumerate(skills_jp):
-                if s_cols[i%2].button(f"{label} ({sk})", use_container_width=True):
-                    st.session_state.current_input_data['skill'] = sk
-                    if sk == 'S': 
-                        st.session_state.current_input_data['player'] = st.session_state.rotation[0]
-                        st.session_state.current_input_data['setter'] = ""
-                        st.session_state.current_input_data['combo'] = ""
-                        st.session_state.scout_step = 4 
-                    elif sk == 'A': st.session_state.scout_step = 15
-                    else: st.session_state.scout_step = 2
-                    st.rerun()
-            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 0; st.rerun()
-
-        elif st.session_state.scout_step == 15:
-            st.markdown('<div class="step-header">2. Attack Phase</div>', unsafe_allow_html=True)
-            att_phases = [("レセプ", "R"), ("トランジション", "T"), ("チャンス", "C")]
-            for label, code in att_phases:
-                if st.button(label, use_container_width=True):
-                    st.session_state.current_input_data['att_phase'] = code
-                    st.session_state.scout_step = 20
-                    st.rerun()
-            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 1; st.rerun()
-
-        elif st.session_state.scout_step == 20:
-            st.markdown('<div class="step-header">2.5 Setter</div>', unsafe_allow_html=True)
-            setters = get_sorted_setters()
-            st_cols = st.columns(2)
-            for i, s in enumerate(setters):
-                if st_cols[i%2].button(s, use_container_width=True):
-                    # ダイレクト = セッターを介さない直接攻撃。setterは空、コンビなしでプレイヤー選択へ
-                    if s == "ダイレクト":
-                        st.session_state.current_input_data['setter'] = ""
-                        st.session_state.current_input_data['combo'] = ""
-                    else:
-                        st.session_state.current_input_data['setter'] = s
-                        count_setter_usage(s)
-                    st.session_state.scout_step = 2
-                    st.rerun()
-            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 15; st.rerun()
-
-        elif st.session_state.scout_step == 2:
-            st.markdown('<div class="step-header">3. Player</div>', unsafe_allow_html=True)
-            candidates = get_sorted_players()
-            curr = st.session_state.current_input_data
-            # アタックでセッターが選ばれている場合のみ「ツー」を候補末尾に追加
-            show_two = curr.get('skill') == 'A' and curr.get('setter', '') != ''
-            p_cols = st.columns(2)
-            for i, p in enumerate(candidates):
-                if p_cols[i%2].button(p, use_container_width=True):
-                    st.session_state.current_input_data['player'] = p
-                    st.session_state.player_counts[p] = st.session_state.player_counts.get(p, 0) + 1
-                    st.session_state.scout_step = 4
-                    st.rerun()
-            if show_two:
-                if st.button("🏐 ツー", use_container_width=True):
-                    # ツー = セッター自身の攻撃。playerをセッターに、comboは「ツー」固定（コンビ入力スキップ）
-                    setter_name = curr.get('setter', '')
-                    st.session_state.current_input_data['player'] = setter_name
-                    st.session_state.current_input_data['combo'] = "ツー"
-                    if setter_name:
-                        st.session_state.player_counts[setter_name] = st.session_state.player_counts.get(setter_name, 0) + 1
-                    st.session_state.scout_step = 4
-                    st.rerun()
-            back_step = 20 if curr.get('skill') == 'A' else 1
-            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = back_step; st.rerun()
-
-        elif st.session_state.scout_step == 4:
-            st.markdown('<div class="step-header">4. Map Input</div>', unsafe_allow_html=True)
-            st.info("👈 左のコートを2回タップ (アウトボールは枠外をタップ)")
-            if st.button("Skip Map", use_container_width=True): 
-                st.session_state.scout_step = 5 if needs_combo() else 6
-                st.rerun()
-            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 2; st.rerun()
-
-        elif st.session_state.scout_step == 5:
-            st.markdown('<div class="step-header">5. Combo</div>', unsafe_allow_html=True)
-            r1 = st.columns(2)
-            for i, c in enumerate(FIXED_COMBOS_TOP):
-                if r1[i%2].button(c, use_container_width=True): st.session_state.current_input_data['combo'] = c; st.session_state.scout_step = 6; st.rerun()
-            st.divider()
-            r2 = st.columns(2)
-            for i, c in enumerate(FIXED_COMBOS_MID):
-                if r2[i%2].button(c, use_container_width=True): st.session_state.current_input_data['combo'] = c; st.session_state.scout_step = 6; st.rerun()
-            st.markdown("---")
-            st.caption("Custom / History")
-            custom_list = get_custom_combos()
-            display_custom = [c for c in custom_list if c not in ALL_FIXED_COMBOS][:4]
-            if display_custom:
-                r3 = st.columns(2)
-                for i, c in enumerate(display_custom):
-                    if r3[i%2].button(c, use_container_width=True): st.session_state.current_input_data['combo'] = c; st.session_state.scout_step = 6; st.rerun()
-            c_val = st.text_input("Type new combo")
-            if st.button("Add & Next", use_container_width=True):
-                if c_val: st.session_state.current_input_data['combo'] = c_val; st.session_state.scout_step = 6; st.rerun()
-            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 4; st.rerun()
-
-        elif st.session_state.scout_step == 6:
-            st.markdown('<div class="step-header">6. Quality</div>', unsafe_allow_html=True)
-            q_cols = st.columns(2)
-            with q_cols[0]:
-                if st.button("# Perfect", use_container_width=True): commit_record("#")
-                if st.button('! OK', use_container_width=True): commit_record('!')
-                if st.button("- ワンチ", use_container_width=True): commit_record("-")
-            with q_cols[1]:
-                if st.button("T BlockOut", use_container_width=True): commit_record("T")
-                if st.button('" Good', use_container_width=True): commit_record('"')
-                if st.button("/ Rebound", use_container_width=True): commit_record("/")
-            if st.button("^ シャット/ミス", use_container_width=True): commit_record("^")
-            st.markdown("---")
-            if st.button("🔙 Back (Map/Combo)", use_container_width=True):
-                st.session_state.scout_step = 5 if needs_combo() else 4
-                st.session_state.points = []; st.session_state.key_map += 1; st.rerun()
-
-        st.markdown("</div>", unsafe_allow_html=True)
-        if st.button("🔄 Reset Input", use_container_width=True):
-            st.session_state.scout_step = 0; st.session_state.points = []; st.rerun()
-
-    st.markdown("### Data Log")
-    if st.button("↩️ Undo Last", use_container_width=True): undo_last_action()
-    if len(st.session_state.data_log) > 0:
-        df = pd.DataFrame(st.session_state.data_log)
-        st.dataframe(df.iloc[::-1], height=150)
-        c1, c2 = st.columns(2)
-        with c1:
-            with st.expander("選手交代 / リベロ"):
-                out_p = st.selectbox("OUT", st.session_state.rotation)
-                in_p = st.text_input("IN Name")
-                if st.button("Change", use_container_width=True):
-                    idx = st.session_state.rotation.index(out_p)
-                    st.session_state.rotation[idx] = in_p
-                    if in_p and in_p not in st.session_state.all_players:
-                        st.session_state.all_players.append(in_p)
-                    st.rerun()
-        with c2:
-            st.markdown("#### Download")
-            c_fmt, c_btn = st.columns(2)
-            with c_fmt: fmt = st.radio("Format", [".xlsx", ".csv"], horizontal=True)
-            with c_btn:
-                export_df = df.copy()
-                export_df.rename(columns={"video_url": "Video_URL", "video_time": "Time_Sec"}, inplace=True)
-                # ★ ファイル名をセット名と合わせる（ファイル名に使えない文字は _ に置換）
-                safe_set = re.sub(r'[\\/:*?"<>|\s]', '_', str(st.session_state.set_name)) or "1"
-                fname = f"scout_set{safe_set}"
-                if fmt == ".xlsx":
-                    buf = io.BytesIO()
-                    with pd.ExcelWriter(buf, engine='xlsxwriter') as writer: export_df.to_excel(writer, index=False)
-                    st.download_button("📥 XLSX", buf.getvalue(), f"{fname}.xlsx", "application/vnd.ms-excel")
-                else:
-                    csv = export_df.to_csv(index=False).encode('utf-8-sig')
-                    st.download_button("📥 CSV", csv, f"{fname}.csv", "text/csv")
-
-    # ★ 予備機能: ローテがずれた時の手動補正
-    st.divider()
-    with st.expander("🔧 予備機能（ローテ手動補正）"):
-        st.caption("ローテが途中でずれてしまった時の応急処置です。スコアは変えずにローテーションだけ1つ回します。①〜⑥はコート上のローテ位置（背番号ではありません）。")
-        cur = st.session_state.rotation
-        if len(cur) >= 6:
-            st.markdown(f"""<div class="rot-grid"><div class="rot-cell rot-front">④ {cur[3]}</div><div class="rot-cell rot-front">③ {cur[4]}</div><div class="rot-cell rot-front">② {cur[5]}</div><div class="rot-cell">⑤ {cur[2]}</div><div class="rot-cell">⑥ {cur[1]}</div><div class="rot-cell rot-server">① {cur[0]}</div></div>""", unsafe_allow_html=True)
-        if st.button("🔄 ローテを一つ回す", use_container_width=True):
-            save_state_to_history()
-            rotate_team()
-            st.toast("ローテを1つ回しました", icon="🔄")
-            st.rerun()
+import streamlit as st
+import re
+import copy
+import functools
+import storage
+import export
+import game_index
+import analytics
+import archive
+from datalog import DataLog
+import events
+import lineup
+import profiler
+import ranking
+from events import FIXED_COMBOS_TOP, FIXED_COMBOS_MID, ALL_FIXED_COMBOS
+# ★ コート描画(PIL/matplotlib)・座標(numpy)・画像タップ部品は記録画面(stage 6)で初めて import する
+#   IDゲートとセットアップ画面は pandas も含めて重いモジュールを読まずに表示できる
+
+st.set_page_config(page_title="Volleyball Scouter Ver.9.10", layout="wide")
+
+st.markdown("""
+<style>
+    .block-container { padding-top: 4rem; padding-bottom: 6rem; }
+    
+    /* カラム間・縦積みの隙間を詰める */
+    div[data-testid="stHorizontalBlock"] { gap: 4px !important; }
+    div[data-testid="stVerticalBlock"] { gap: 4px !important; }
+
+    /* ボタンの高さ・文字だけ指定（幅は use_container_width に任せる） */
+    div[data-testid="stButton"] button {
+        height: 80px !important;
+        font-weight: 900 !important;
+        font-size: 24px !important;
+        border-radius: 6px !important;
+        touch-action: manipulation;
+    }
+
+    .keypad-btn > button { height: 80px !important; font-size: 32px !important; }
+    
+    div.stDownloadButton > button {
+        background-color: #FF4B4B; color: white; height: 80px; font-size: 24px;
+        border: 2px solid white; box-shadow: 0 4px 6px rgba(0,0,0,0.1);
+    }
+    .score-board { font-size: 40px; font-weight: 900; text-align: center; background: #333; color: white; padding: 5px; border-radius: 8px; }
+    .input-card { background-color: #f8f9fa; padding: 10px; border-radius: 15px; border: 2px solid #e9ecef; }
+    .step-header { font-size: 20px; font-weight: bold; color: #4c78a8; margin-bottom: 5px; border-bottom: 2px solid #4c78a8; }
+    .rot-grid { display: grid; grid-template-columns: 1fr 1fr 1fr; gap: 4px; text-align: center; font-weight: bold; font-size: 14px; }
+    .rot-cell { border: 1px solid #555; padding: 8px; background: white; border-radius: 6px; }
+    .rot-front { background: #ffebeb; }
+    .rot-server { border: 3px solid red; color: red; font-weight: 900; }
+</style>
+""", unsafe_allow_html=True)
+
+defaults = {
+    'game_id': '',
+    'stage': 0, 'roster_cursor': 0, 'temp_roster': [], 'scout_step': 0,
+    'set_name': '1', 'video_url': '', 'liberos': [], 'rotation': [], 'lineup': None, 'score': [0, 0], 'phase': 'R',
+    'current_input_data': {}, 'data_log': DataLog(), 'points': [], 
+    'setter_counts': {}, 'player_counts': {}, 'all_players': [], 'stats': events.empty_stats(),
+    'key_map': 0, 'time_buffer': "", 'key_roster': 0, 'event_log': None, 'custom_combo_pool': {},
+    'journal': None, 'journal_ops': [], 'saver': None, 'export_cache': {}, 'chart_cache': {}, 'gate_page': 0,
+    'stale_writer': False, 'aggregates': analytics.Aggregates(), 'sets': [],
+}
+for k, v in defaults.items():
+    if k not in st.session_state: st.session_state[k] = v
+
+# ★ 計測（SCOUT_PROFILE=1 の時だけ）。リランごとの区間時間をセッションのリングバッファに積む
+if profiler.ENABLED:
+    if 'profile' not in st.session_state: st.session_state.profile = profiler.Profile()
+    profiler.begin_rerun(st.session_state.profile, f"stage{st.session_state.stage}")
+
+# ★ ゲーム関連のセッション状態をデフォルトに戻す（game_id以外）
+def reset_session():
+    for k, v in defaults.items():
+        if k == 'game_id':
+            continue
+        st.session_state[k] = copy.deepcopy(v)
+
+# ★ 現在のIDの保存ファイルがあれば読み込む。成功でTrue
+@profiler.timed("load_game")
+def load_game():
+    if st.session_state.journal is not None and st.session_state.journal.game_id == st.session_state.game_id:
+        st.session_state.journal.retry()  # エラーで戻された保存があれば先に書き直す
+    storage.drain(st.session_state.game_id)  # 背景の保存が残っていれば書き終わってから読む
+    journal = storage.Journal(st.session_state.game_id)
+    loaded = journal.load()
+    if loaded is None and archive.restore(st.session_state.game_id):  # 退避済みの試合は書き戻してから開く
+        loaded = journal.load()
+    if loaded is None:
+        return False
+    st.session_state.journal = journal
+    st.session_state.journal_ops = []
+    st.session_state.data_log, d, elog = loaded
+    # 読み直した DataLog は version が 0 から数え直すので、前の DataLog で作った書き出し・チャートは使わない
+    st.session_state.export_cache = {}
+    st.session_state.chart_cache = {}
+    st.session_state.set_name = d["set_name"]; st.session_state.video_url = d["video_url"]
+    st.session_state.liberos = d["liberos"]
+    st.session_state.all_players = d.get("all_players", [p for p in d["rotation"] + d["liberos"] if p])
+    st.session_state.sets = d.get("sets", [])
+    # ★ 集計は試合全体。凍結セットの分は読み込み時に1回だけ足す
+    agg = analytics.Aggregates.from_frame(st.session_state.data_log.frame())
+    for entry in st.session_state.sets:
+        agg.merge(analytics.Aggregates.from_frame(storage.read_set(entry, analytics.COLUMNS).frame()))
+    st.session_state.aggregates = agg
+    if elog is None and d.get("stage", 6) < 6:
+        # 次のセットのセットアップ途中: 入力済みの項目だけ戻して続きから
+        #   前のセットのイベント列・ラインナップ・集計はセッションに残さない（rebase が前のセットに op を積まないように）
+        for k in ("event_log", "lineup", "stats"):
+            st.session_state[k] = copy.deepcopy(defaults[k])
+        for k in ("score", "rotation", "phase", "setter_counts", "player_counts", "custom_combo_pool"):
+            if k in d: st.session_state[k] = d[k]
+        st.session_state.stage = 2 if d["stage"] == 3 else d["stage"]  # 確認画面の仮ラインナップは保存していない
+        return True
+    if elog is None:
+        # イベント列の無い保存（旧形式・試合開始前）: 保存時点の状態を初期状態にして続きから積む
+        init = {"setter_counts": {}, "player_counts": {}, "custom_combo_pool": {}}
+        init.update({k: d[k] for k in events.DERIVED + ('rotation',) if k in d})
+        start_match(init)
+    else:
+        st.session_state.event_log = elog
+        # チェックポイントから出した状態を保存時のスコア・局面と突き合わせ、食い違う時だけ全再生で確かめる
+        suspect = d.get("score", elog.state["score"]) != elog.state["score"] or d.get("phase", elog.state["phase"]) != elog.state["phase"]
+        if (suspect or events.VERIFY_ON_LOAD) and not elog.verify():
+            st.warning("保存データの状態がイベント列と一致しません（イベント列を正として再開します）")
+            elog.state = events.fold(elog.init, elog.events)
+        sync_derived()
+    st.session_state.stage = 6
+    return True
+
+# ★ 試合開始: 現在のスコア・ローテ等を初期状態としてイベント列を作る
+def start_match(init):
+    elog = st.session_state.event_log = events.EventLog(init)
+    st.session_state.journal_ops.append({"op": "start", "init": elog.init})
+    sync_derived()
+
+# ★ スコア・ローテ・カウンタはイベント列からの導出結果をセッションに置くだけ
+#   rotation は保存・選択肢用の並び（表示・記録行のポジションは lineup から直接引く）
+def sync_derived():
+    for k in events.DERIVED:
+        st.session_state[k] = st.session_state.event_log.state[k]
+    st.session_state.rotation = lineup.order(st.session_state.lineup)
+
+# ★ ジャーナルの op（ev / undo / redo）をセッションの記録行・イベント列・集計に適用する
+#   自分の操作も、他の端末が同じIDに追記した op もここを通る
+def apply_op(op):
+    log, elog, agg = st.session_state.data_log, st.session_state.event_log, st.session_state.aggregates
+    if op["op"] == "ev":
+        if op["row"] is not None:
+            row = lineup.stamp(op["row"], elog.state["lineup"])  # 他の端末の op はポジション無しで届く
+            log.append(row)
+            agg.add(row)
+        elog.push(op["ev"])
+    elif op["op"] == "undo":
+        events.undo_event(elog, log)
+        popped = elog.redo_stack[-1][1]
+        if popped is not None: agg.remove(popped)
+    elif op["op"] == "redo":
+        if events.redo_event(elog, log)['k'] == 'row':
+            agg.add(log.row(len(log) - 1))
+    sync_derived()
+
+# ★ イベントを1件積む（記録行を伴う場合は row もデータログに追加）
+def push_event(ev, row=None):
+    op = {"op": "ev", "ev": ev, "row": row}
+    apply_op(op)
+    st.session_state.journal_ops.append(op)
+
+# ★ 同じIDを入力している他の端末の追記を取り込む（リランの最初に毎回。変更が無ければロックファイルを1回読むだけ）
+#   差分が途切れている時（相手がセットを終了した等）や op が記録以外の時は保存から読み直す
+def sync_remote():
+    j = st.session_state.journal
+    if j is None or st.session_state.event_log is None or st.session_state.stale_writer:
+        return
+    if storage.head_seq(j.game_id) in (None, j.seq):
+        return
+    flush_save(force=True)  # 未保存の自分の op を先に書く（ぶつかれば flush_save 側で積み直す）
+    j = st.session_state.journal
+    if st.session_state.stale_writer or j is None:
+        return
+    j.drain()
+    ops = j.changes()
+    if ops is None or any(op["op"] not in ("ev", "undo", "redo", "state") for op in ops):
+        load_game()
+        return
+    for op in ops:
+        if op["op"] == "state":
+            for k in ("set_name", "video_url", "liberos", "all_players"):
+                if k in op["state"]: st.session_state[k] = op["state"][k]
+        else:
+            apply_op(op)
+
+def undo_last_action():
+    if st.session_state.event_log.events:
+        apply_op({"op": "undo"})
+        st.session_state.journal_ops.append({"op": "undo"})
+        st.toast("Undo Successful", icon="↩️")
+    elif len(st.session_state.data_log) > 0:
+        # イベント列より前の旧形式の行: 行だけ消す
+        st.session_state.aggregates.remove(st.session_state.data_log.pop())
+        st.session_state.journal_ops.append({"op": "pop"})
+    else:
+        st.warning("No data to delete")
+        return
+    auto_save()
+    rerun()
+
+def redo_last_action():
+    if not st.session_state.event_log.redo_stack:
+        st.warning("Nothing to redo")
+        return
+    apply_op({"op": "redo"})
+    st.session_state.journal_ops.append({"op": "redo"})
+    st.toast("Redo Successful", icon="↪️")
+    auto_save()
+    rerun()
+
+def get_saver():
+    if st.session_state.saver is None:
+        st.session_state.saver = storage.SaveCoalescer(storage.SAVE_IDLE_SEC)
+    return st.session_state.saver
+
+# ★ 保存要求は印を付けるだけ。実際の書き込みは flush_save() で1リラン1回にまとめる
+def auto_save():
+    if not st.session_state.game_id:
+        return  # IDが未設定なら保存しない
+    get_saver().mark()
+
+# ★ 溜まった行の追加/削除と現在の状態をジャーナルに追記するだけ（全行のCSV書き直しは定期的な圧縮時のみ）
+#   force=False なら SAVE_IDLE_SEC 経過前の書き込みは見送る
+#   ASYNC_SAVE なら背景スレッドに渡して戻る。背景で書けなかった op は次の呼び出しで先頭に戻して積み直す
+@profiler.timed("auto_save")
+def flush_save(force=False, retry=True):
+    saver = get_saver()
+    if not st.session_state.game_id or st.session_state.stale_writer:
+        return
+    if storage.ASYNC_SAVE:
+        get_journal().retry()  # 前回ディスク等のエラーで書けなかった分
+    if not saver.due(force) and not get_journal().failed:
+        return
+    state_data = current_state()
+    ops = st.session_state.journal_ops + [{"op": "state", "state": state_data}]
+    st.session_state.journal_ops = []
+    failed = get_journal().take_failed()
+    for e in storage.save_errors(st.session_state.game_id):
+        st.warning(f"保存に失敗しました: {e}")
+    try:
+        if failed:
+            ops = failed + ops
+            raise storage.StaleWriterError(st.session_state.game_id)
+        if storage.ASYNC_SAVE:
+            get_journal().submit(ops, st.session_state.data_log, state_data, st.session_state.event_log)
+        else:
+            get_journal().write(ops, st.session_state.data_log, state_data, st.session_state.event_log)
+    except storage.StaleWriterError:
+        # 別のタブ/端末が先に追記していた: 保存から読み直し、自分の op をその後ろに積み直して書き直す
+        #   それでも書けない時は上書きせず、読み直すまで保存を止める
+        if retry and rebase(ops):
+            return flush_save(force=True, retry=False)
+        st.session_state.stale_writer = True
+        return
+    saver.done()
+
+def rebase(ops):
+    if any(op["op"] not in ("ev", "undo", "redo", "state") for op in ops):
+        return False
+    mine = [op for op in ops if op["op"] != "state"]
+    players = st.session_state.all_players
+    load_game()
+    st.session_state.all_players = list(dict.fromkeys(st.session_state.all_players + players))
+    elog = st.session_state.event_log
+    if elog is None:
+        st.warning("他の端末がセットを終了したため、このセットへの未保存の入力は取り込めませんでした")
+    else:
+        for op in mine:
+            if (op["op"] == "undo" and not elog.events) or (op["op"] == "redo" and not elog.redo_stack):
+                continue
+            apply_op(op)
+            st.session_state.journal_ops.append(op)
+    get_saver().mark()
+    return True
+
+def get_journal():
+    if st.session_state.journal is None or st.session_state.journal.game_id != st.session_state.game_id:
+        st.session_state.journal = storage.Journal(st.session_state.game_id)
+    return st.session_state.journal
+
+def current_state():
+    return {
+        "score": st.session_state.score, "rotation": st.session_state.rotation, "phase": st.session_state.phase,
+        "set_name": st.session_state.set_name, "video_url": st.session_state.video_url, "liberos": st.session_state.liberos,
+        "setter_counts": st.session_state.setter_counts, "player_counts": st.session_state.player_counts,
+        "all_players": st.session_state.all_players,
+        "custom_combo_pool": st.session_state.custom_combo_pool, "stage": st.session_state.stage,
+        "sets": st.session_state.sets
+    }
+
+# ★ セット終了: 今のセットを凍結して保存し、次のセットのセットアップ（セット名から）に戻る
+#   選手・リベロ・動画URL・選手/セッター/コンビの使用回数は引き継ぐ。集計は試合全体のまま
+def finish_set():
+    done = (st.session_state.data_log, current_state(), st.session_state.event_log)
+    name = str(st.session_state.set_name)
+    st.session_state.set_name = str(int(name) + 1) if name.isdigit() else name
+    for k in ('data_log', 'event_log', 'score', 'rotation', 'lineup', 'phase', 'stats', 'temp_roster', 'roster_cursor',
+              'points', 'current_input_data', 'scout_step', 'journal_ops', 'export_cache', 'chart_cache'):
+        st.session_state[k] = copy.deepcopy(defaults[k])
+    st.session_state.key_roster += 1
+    st.session_state.stage = 0
+    try:
+        get_journal().drain()
+        entry = get_journal().finish_set(*done, st.session_state.data_log, current_state())
+    except storage.StaleWriterError:
+        st.session_state.stale_writer = True
+        return
+    st.session_state.sets = st.session_state.sets + [entry]
+
+# ★ st.rerun() の前に必ず保存を渡し切る（ASYNC_SAVE なら背景の列に積んだ時点で戻る。終了時は atexit で書き切る）
+def rerun():
+    flush_save(force=True)
+    st.rerun()
+
+def format_time(val):
+    s = str(val).strip()
+    if len(s) == 0: return "00:00"
+    v = int(s)
+    if len(s) <= 2: return f"00:{v:02d}"
+    sec = int(s[-2:]); min_ = int(s[:-2])
+    return f"{min_:02d}:{sec:02d}"
+
+def time_to_sec(t_str):
+    if ':' not in t_str: return 0
+    m, s = t_str.split(':')
+    return int(m)*60 + int(s)
+
+def rotate_team():
+    push_event({'k': 'rotate'})
+    auto_save()
+
+def toast_point(winner):
+    if winner == 'my':
+        st.toast("Sideout!" if st.session_state.phase == 'R' else "Break!", icon="⭕")
+    elif winner == 'op':
+        st.toast("Op Point", icon="❌")
+
+def update_score(winner):
+    toast_point(winner)
+    push_event({'k': 'point', 'w': winner})
+    auto_save()
+
+def commit_record(quality, winner=None):
+    import zones
+    curr = st.session_state.current_input_data
+    # ★ 座標の向きそろえ（下→上を上→下へ）とゾーン分けは一括再処理と同じ zones モジュールで行う
+    s_x, s_y, e_x, e_y, s_z, e_z = zones.locate(st.session_state.points)
+    final_row = {
+        "set": st.session_state.set_name,
+        "score": f"{st.session_state.score[0]}-{st.session_state.score[1]}",
+        "phase": st.session_state.phase,
+        "setter": curr.get('setter',''), "player": curr.get('player',''),
+        "skill": curr.get('skill',''), "combo": curr.get('combo',''),
+        "quality": quality,
+        "start_zone": s_z, "end_zone": e_z,
+        "start_x": s_x, "start_y": s_y, "end_x": e_x, "end_y": e_y,
+        "memo": "", "video_url": st.session_state.video_url,
+        "video_time": time_to_sec(curr.get('time',''))
+    }
+    # ★ その時点のローテにおけるポジション1〜6の選手名を右端に追加（回転前に取得）
+    final_row.update(get_positions())
+    # ★ アタック局面（レセプR/トランジションT/チャンスC）を最右列に追加。アタック以外は空。
+    final_row["att_phase"] = curr.get('att_phase', '') if curr.get('skill') == 'A' else ''
+    if not winner:
+        winner = events.point_winner(curr.get('skill',''), quality)
+    if winner: toast_point(winner)
+    else: st.toast("Saved", icon="✅")
+    # ★ スコア・ローテ・各カウンタはこのイベントから導出される（セッターや選手の使用回数も記録確定時に数える）
+    push_event({'k': 'row', 'w': winner, 'setter': final_row['setter'], 'player': final_row['player'],
+                'skill': final_row['skill'], 'combo': final_row['combo'], 'q': quality}, final_row)
+    st.session_state.points = []
+    st.session_state.current_input_data = {}
+    st.session_state.scout_step = 0
+    st.session_state.key_map += 1
+    st.session_state.time_buffer = "" 
+    auto_save()
+    rerun()
+
+# ★ 候補は使用回数順（イベント列の状態が回数の増えるたびに並びを保っているので、ここではソートしない）
+def get_sorted_players():
+    return ranking.ranked(st.session_state.event_log.state['ranks']['player'], st.session_state.all_players)
+
+def get_sorted_setters():
+    return ranking.ranked(st.session_state.event_log.state['ranks']['setter'], st.session_state.all_players) + ["ダイレクト"]
+
+def get_custom_combos():
+    return list(st.session_state.event_log.state['ranks']['combo']['order'])
+
+# ★ コンビ入力(step5)が必要か: スパイク かつ セッター経由(ダイレクト/ツーでない)
+def needs_combo():
+    curr = st.session_state.current_input_data
+    if curr.get('skill') != 'A':
+        return False
+    if curr.get('setter', '') == '':       # ダイレクト（セッター空）
+        return False
+    if curr.get('combo', '') == 'ツー':     # ツー（comboは既に確定済み）
+        return False
+    return True
+
+# ★ 現ローテにおける各ポジション(1〜6)の選手名を返す
+def get_positions():
+    return lineup.positions(st.session_state.lineup)
+
+# ★ ローテ表（前衛 ④③② / 後衛 ⑤⑥①）
+def rot_grid(lu):
+    cell = lambda p, cls: f'<div class="rot-cell {cls}">{"①②③④⑤⑥"[p - 1]} {lineup.at(lu, p)}</div>'
+    cells = [cell(4, "rot-front"), cell(3, "rot-front"), cell(2, "rot-front"), cell(5, ""), cell(6, ""), cell(1, "rot-server")]
+    st.markdown(f'<div class="rot-grid">{"".join(cells)}</div>', unsafe_allow_html=True)
+
+# ==========================================
+# 3. アプリ進行フロー
+# ==========================================
+sync_remote()
+
+with st.sidebar:
+    st.header("🔑 解析ID")
+    if st.session_state.game_id:
+        st.success(f"現在のID: **{st.session_state.game_id}**")
+        st.caption("このIDに紐づくデータが随時保存されます")
+        saver = get_saver()
+        st.caption(f"保存 {saver.writes}回 / まとめた保存要求 {saver.coalesced}回")
+        if st.button("🔄 ID変更 / 別の試合へ", use_container_width=True):
+            flush_save(force=True)
+            reset_session()
+            st.session_state.game_id = ''
+            rerun()
+    else:
+        st.caption("最初にIDを入力してください")
+    if profiler.ENABLED:
+        with st.expander("⏱ 計測（直近のリラン）"):
+            prof = st.session_state.profile
+            summary = prof.summary()
+            st.dataframe({"区間": list(summary), **{k: [s[k] for s in summary.values()] for k in ("n", "p50", "p95", "max")}},
+                         hide_index=True)
+            st.caption(f"{len(prof.runs)} / {prof.runs.maxlen} リラン（ms）")
+            st.download_button("📥 プロファイル (JSON)", prof.dump, f"profile_{st.session_state.game_id or 'gate'}.json",
+                               "application/json", use_container_width=True)
+
+# ★ IDゲート: game_idが未設定なら、ID入力画面を表示してここで止める
+if not st.session_state.game_id:
+    st.title("🔑 解析IDを入力")
+    st.caption("5桁の数字IDを入力してください。複数人で解析する場合は各自で別のIDを使います。")
+    id_val = st.text_input("ID (5桁)", max_chars=5, placeholder="例: 12345")
+    if st.button("▶️ 開始 / 再開", use_container_width=True):
+        if len(id_val) == 5 and id_val.isdigit():
+            st.session_state.game_id = id_val
+            if load_game():
+                st.toast("続きから再開しました", icon="📂")
+            else:
+                st.session_state.stage = 0  # 新規セットアップ
+                st.toast("新しい試合を開始します", icon="🆕")
+            rerun()
+        else:
+            st.error("5桁の数字を入力してください")
+
+    # 既存の保存データをワンタップで再開（索引から新しい順に1ページ分だけ表示）
+    q = st.text_input("🔍 IDで検索", key="gate_query")
+    with profiler.span("id_gate_list"):
+        game_index.ensure_index()
+        total = game_index.count_games(q)
+        games = game_index.list_games(q, min(st.session_state.gate_page, max(total - 1, 0) // game_index.PAGE_SIZE))
+    if total:
+        st.markdown("---")
+        st.subheader(f"保存済みデータから再開 ({total}件)")
+        pages = (total - 1) // game_index.PAGE_SIZE + 1
+        page = min(st.session_state.gate_page, pages - 1)
+        cols = st.columns(3)
+        for i, (sid, set_name, score, n_rows, _) in enumerate(games):
+            if cols[i % 3].button(f"ID {sid}  Set{set_name} {score} ({n_rows})", key=f"resume_{sid}", use_container_width=True):
+                st.session_state.game_id = sid
+                load_game()
+                st.toast(f"ID {sid} を再開", icon="📂")
+                rerun()
+        if pages > 1:
+            p1, p2, p3 = st.columns([1, 2, 1])
+            if p1.button("◀", disabled=page == 0, use_container_width=True): st.session_state.gate_page = page - 1; rerun()
+            p2.caption(f"{page + 1} / {pages}")
+            if p3.button("▶", disabled=page >= pages - 1, use_container_width=True): st.session_state.gate_page = page + 1; rerun()
+    # 退避済みの試合は検索した時だけ目録から引く（開くと書き戻して再開）
+    if q:
+        found = archive.search(q)
+        if found:
+            st.subheader(f"退避済み ({len(found)}件)")
+            cols = st.columns(3)
+            for i, r in enumerate(found):
+                if cols[i % 3].button(f"📦 ID {r['game_id']}  {r['sets']} ({r['rows']})", key=f"restore_{r['game_id']}", use_container_width=True):
+                    st.session_state.game_id = r['game_id']
+                    load_game()
+                    st.toast(f"ID {r['game_id']} を復元して再開", icon="📦")
+                    rerun()
+    with st.expander("🗄 保存データの整理"):
+        days = st.number_input("この日数更新の無い試合を退避", min_value=1, value=archive.ARCHIVE_AFTER_DAYS)
+        if st.button("📦 退避する", use_container_width=True):
+            done = archive.archive_inactive(days)
+            removed = archive.clean()
+            st.toast(f"{len(done)}試合を退避・残骸 {len(removed)} 件を削除", icon="📦")
+            rerun()
+        st.caption("退避分の削除（元に戻せません。0 は制限なし）")
+        c1, c2 = st.columns(2)
+        max_age = c1.number_input("最終更新からの日数", min_value=0, value=0)
+        max_mb = c2.number_input("保存全体の上限 (MB)", min_value=0, value=0)
+        if st.checkbox("削除してよい", key="evict_ok") and st.button("🗑 古い退避分を削除", use_container_width=True):
+            gone = archive.evict(max_age or None, max_mb * 1e6 or None)
+            st.toast(f"{len(gone)}試合の退避分を削除", icon="🗑")
+            rerun()
+        if st.button("📊 使用量を確認", use_container_width=True):
+            live, size, n = archive.usage()
+            st.caption(f"保存 {archive.mb(live)} / 退避 {n}件 {archive.mb(size)}")
+    profiler.end_rerun()
+    st.stop()
+
+if st.session_state.stale_writer:
+    st.error("このIDには別のタブ/端末が後から保存しています。上書きを防ぐため保存を止めました。最新の保存を読み込んでください。")
+    if st.button("📂 最新の保存を読み込む", use_container_width=True):
+        st.session_state.stale_writer = False
+        load_game()
+        rerun()
+
+if st.session_state.stage < 6:
+    st.title("🛠️ Game Setup")
+    if st.session_state.stage == 0:
+        st.subheader("Step 1: Set Number")
+        val = st.text_input("Set", value=str(st.session_state.set_name))
+        if st.button("Next", use_container_width=True): st.session_state.set_name = val; st.session_state.stage = 1; auto_save(); rerun()
+    elif st.session_state.stage == 1:
+        st.subheader("Step 2: Video URL")
+        val = st.text_input("URL", value=st.session_state.video_url)
+        if st.button("Next", use_container_width=True): st.session_state.video_url = val; st.session_state.stage = 2; auto_save(); rerun()
+    elif st.session_state.stage == 2:
+        idx = st.session_state.roster_cursor
+        pos_names = ["1 (Server)", "6 (Back-C)", "5 (Back-L)", "4 (Front-L)", "3 (Front-C)", "2 (Front-R)"]
+        st.subheader(f"Step 3: Lineup ({idx+1}/6)")
+        st.info(f"Position: **{pos_names[idx]}**")
+        k = f"roster_{idx}_{st.session_state.key_roster}"
+        p_name = st.text_input("Player Name", key=k)
+        if st.button("Add Player", use_container_width=True):
+            if p_name:
+                st.session_state.temp_roster.append(p_name)
+                st.session_state.key_roster += 1
+                if st.session_state.roster_cursor < 5: st.session_state.roster_cursor += 1
+                else: st.session_state.stage = 3
+                rerun()
+    elif st.session_state.stage == 3:
+        st.subheader("Step 4: Confirm")
+        rot_grid(lineup.new(st.session_state.temp_roster))
+        c1, c2 = st.columns(2)
+        if c1.button("OK", use_container_width=True): st.session_state.rotation = st.session_state.temp_roster; st.session_state.stage = 4; auto_save(); rerun()
+        if c2.button("Retry", use_container_width=True): st.session_state.stage = 2; st.session_state.roster_cursor = 0; st.session_state.temp_roster = []; rerun()
+    elif st.session_state.stage == 4:
+        st.subheader("Step 5: Liberos")
+        val = st.text_input("Names (comma separated)", value=", ".join(st.session_state.liberos))
+        if st.button("Next", use_container_width=True): st.session_state.liberos = [x.strip() for x in val.split(',') if x.strip()]; st.session_state.stage = 5; auto_save(); rerun()
+    elif st.session_state.stage == 5:
+        st.subheader("Step 6: First Phase")
+        c1, c2 = st.columns(2)
+        if c1.button("Serve (We)", use_container_width=True): 
+            st.session_state.all_players = list(dict.fromkeys(st.session_state.all_players + [p for p in st.session_state.rotation + st.session_state.liberos if p]))
+            st.session_state.phase = 'S'; st.session_state.stage = 6; start_match(st.session_state); auto_save(); rerun()
+        if c2.button("Reception (Op)", use_container_width=True): 
+            st.session_state.all_players = list(dict.fromkeys(st.session_state.all_players + [p for p in st.session_state.rotation + st.session_state.liberos if p]))
+            st.session_state.phase = 'R'; st.session_state.stage = 6; start_match(st.session_state); auto_save(); rerun()
+
+elif st.session_state.stage == 6:
+    # ★ 同じIDを別の端末でも入力している時: 数秒ごとにロックファイルの seq だけ見て、変わっていればリラン
+    @st.fragment(run_every=storage.SYNC_POLL_SEC)
+    def watch_remote():
+        j = st.session_state.journal
+        if (j is not None and not st.session_state.stale_writer and not storage.saving(j.game_id)
+                and storage.head_seq(j.game_id) not in (None, j.seq)):
+            st.rerun(scope="app")
+    watch_remote()
+
+    c_score, c_rot = st.columns([1.3, 1.0]) 
+    with c_score:
+        st.markdown(f'<div class="score-board">{st.session_state.score[0]}-{st.session_state.score[1]} ({st.session_state.phase})</div>', unsafe_allow_html=True)
+        b1, b2 = st.columns(2)
+        if b1.button("My Point (+1)", use_container_width=True): update_score('my'); rerun()
+        if b2.button("Op Point (+1)", use_container_width=True): update_score('op'); rerun()
+        # ★ ライブ集計（イベントの畳み込みで更新済みのカウンタを表示するだけ。ログは走査しない）
+        stats = st.session_state.stats
+        pct = lambda won, n: f"{won}/{n} ({won / n * 100:.0f}%)" if n else "-"
+        st.caption(f"Sideout {pct(*stats['so'])}　Break {pct(*stats['bp'])}")
+        att = "　".join(f"{p} {(k - e) / n * 100:+.0f}% ({k}-{e}/{n})" for p, (n, k, e) in stats['att'].items() if n)
+        if att: st.caption(f"Attack eff: {att}")
+    with c_rot:
+        rot_grid(st.session_state.lineup)
+
+    st.divider()
+    
+    col_map, col_card = st.columns([1.3, 1.0])
+    
+    with col_map:
+        st.markdown("**MAP (タップで着地点を記録)**")
+        from court import create_court_img
+        from streamlit_image_coordinates import streamlit_image_coordinates
+        court_img = create_court_img(st.session_state.points)
+        val = streamlit_image_coordinates(court_img, key=f"main_court_{st.session_state.key_map}", width=450, height=720)
+        if val:
+            px, py = val['x'], val['y']
+            lx = -3 + (px / 450) * 15
+            ly = 21 - (py / 720) * 24
+            p = (px, py, lx, ly)
+            if not st.session_state.points or st.session_state.points[-1][:2] != (px, py):
+                if len(st.session_state.points) < 2:
+                    st.session_state.points.append(p)
+                    if len(st.session_state.points) == 2 and st.session_state.scout_step == 4:
+                        st.session_state.scout_step = 5 if needs_combo() else 6
+                    rerun()
+                else:
+                    st.session_state.points = [p]; rerun()
+        msg = "Start" if len(st.session_state.points)==0 else ("End" if len(st.session_state.points)==1 else "Done")
+        st.caption(f"Tap: {msg}")
+
+    with col_card:
+        st.markdown('<div class="input-card">', unsafe_allow_html=True)
+        
+        if st.session_state.scout_step == 0:
+            st.markdown('<div class="step-header">1. Time</div>', unsafe_allow_html=True)
+            disp_time = format_time(st.session_state.time_buffer)
+            st.markdown(f"<h1 style='text-align:center; font-size:60px; margin:0;'>{disp_time}</h1>", unsafe_allow_html=True)
+            with st.container():
+                k1, k2, k3 = st.columns(3)
+                with k1: 
+                    if st.button("7", key="k7", use_container_width=True): st.session_state.time_buffer += "7"; rerun()
+                with k2: 
+                    if st.button("8", key="k8", use_container_width=True): st.session_state.time_buffer += "8"; rerun()
+                with k3: 
+                    if st.button("9", key="k9", use_container_width=True): st.session_state.time_buffer += "9"; rerun()
+                k4, k5, k6 = st.columns(3)
+                with k4: 
+                    if st.button("4", key="k4", use_container_width=True): st.session_state.time_buffer += "4"; rerun()
+                with k5: 
+                    if st.button("5", key="k5", use_container_width=True): st.session_state.time_buffer += "5"; rerun()
+                with k6: 
+                    if st.button("6", key="k6", use_container_width=True): st.session_state.time_buffer += "6"; rerun()
+                k7, k8, k9 = st.columns(3)
+                with k7: 
+                    if st.button("1", key="k1", use_container_width=True): st.session_state.time_buffer += "1"; rerun()
+                with k8: 
+                    if st.button("2", key="k2", use_container_width=True): st.session_state.time_buffer += "2"; rerun()
+                with k9: 
+                    if st.button("3", key="k3", use_container_width=True): st.session_state.time_buffer += "3"; rerun()
+                k0, kc, ke = st.columns(3)
+                with k0: 
+                    if st.button("0", key="k0", use_container_width=True): st.session_state.time_buffer += "0"; rerun()
+                with kc: 
+                    if st.button("C", key="kclr", use_container_width=True): st.session_state.time_buffer = ""; rerun()
+                with ke: 
+                    if st.button("⏎", key="kent", type="primary", use_container_width=True):
+                        st.session_state.current_input_data['time'] = disp_time
+                        st.session_state.scout_step = 1; rerun()
+
+        elif st.session_state.scout_step == 1:
+            st.markdown('<div class="step-header">2. Skill</div>', unsafe_allow_html=True)
+            skills_jp = [("S", "サーブ"), ("R", "レセプション"), ("A", "スパイク"), ("B", "ブロック"), ("D", "ディグ"), ("E", "セット")]
+            s_cols = st.columns(2)
+            for i, (sk, label) in enumerate(skills_jp):
+                if s_cols[i%2].button(f"{label} ({sk})", use_container_width=True):
+                    st.session_state.current_input_data['skill'] = sk
+                    if sk == 'S': 
+                        st.session_state.current_input_data['player'] = lineup.at(st.session_state.lineup, 1)
+                        st.session_state.current_input_data['setter'] = ""
+                        st.session_state.current_input_data['combo'] = ""
+                        st.session_state.scout_step = 4 
+                    elif sk == 'A': st.session_state.scout_step = 15
+                    else: st.session_state.scout_step = 2
+                    rerun()
+            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 0; rerun()
+
+        elif st.session_state.scout_step == 15:
+            st.markdown('<div class="step-header">2. Attack Phase</div>', unsafe_allow_html=True)
+            att_phases = [("レセプ", "R"), ("トランジション", "T"), ("チャンス", "C")]
+            for label, code in att_phases:
+                if st.button(label, use_container_width=True):
+                    st.session_state.current_input_data['att_phase'] = code
+                    st.session_state.scout_step = 20
+                    rerun()
+            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 1; rerun()
+
+        elif st.session_state.scout_step == 20:
+            st.markdown('<div class="step-header">2.5 Setter</div>', unsafe_allow_html=True)
+            setters = get_sorted_setters()
+            st_cols = st.columns(2)
+            for i, s in enumerate(setters):
+                if st_cols[i%2].button(s, use_container_width=True):
+                    # ダイレクト = セッターを介さない直接攻撃。setterは空、コンビなしでプレイヤー選択へ
+                    if s == "ダイレクト":
+                        st.session_state.current_input_data['setter'] = ""
+                        st.session_state.current_input_data['combo'] = ""
+                    else:
+                        st.session_state.current_input_data['setter'] = s
+                    st.session_state.scout_step = 2
+                    rerun()
+            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 15; rerun()
+
+        elif st.session_state.scout_step == 2:
+            st.markdown('<div class="step-header">3. Player</div>', unsafe_allow_html=True)
+            candidates = get_sorted_players()
+            curr = st.session_state.current_input_data
+            # アタックでセッターが選ばれている場合のみ「ツー」を候補末尾に追加
+            show_two = curr.get('skill') == 'A' and curr.get('setter', '') != ''
+            p_cols = st.columns(2)
+            for i, p in enumerate(candidates):
+                if p_cols[i%2].button(p, use_container_width=True):
+                    st.session_state.current_input_data['player'] = p
+                    st.session_state.scout_step = 4
+                    rerun()
+            if show_two:
+                if st.button("🏐 ツー", use_container_width=True):
+                    # ツー = セッター自身の攻撃。playerをセッターに、comboは「ツー」固定（コンビ入力スキップ）
+                    setter_name = curr.get('setter', '')
+                    st.session_state.current_input_data['player'] = setter_name
+                    st.session_state.current_input_data['combo'] = "ツー"
+                    st.session_state.scout_step = 4
+                    rerun()
+            back_step = 20 if curr.get('skill') == 'A' else 1
+            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = back_step; rerun()
+
+        elif st.session_state.scout_step == 4:
+            st.markdown('<div class="step-header">4. Map Input</div>', unsafe_allow_html=True)
+            st.info("👈 左のコートを2回タップ (アウトボールは枠外をタップ)")
+            if st.button("Skip Map", use_container_width=True): 
+                st.session_state.scout_step = 5 if needs_combo() else 6
+                rerun()
+            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 2; rerun()
+
+        elif st.session_state.scout_step == 5:
+            st.markdown('<div class="step-header">5. Combo</div>', unsafe_allow_html=True)
+            r1 = st.columns(2)
+            for i, c in enumerate(FIXED_COMBOS_TOP):
+                if r1[i%2].button(c, use_container_width=True): st.session_state.current_input_data['combo'] = c; st.session_state.scout_step = 6; rerun()
+            st.divider()
+            r2 = st.columns(2)
+            for i, c in enumerate(FIXED_COMBOS_MID):
+                if r2[i%2].button(c, use_container_width=True): st.session_state.current_input_data['combo'] = c; st.session_state.scout_step = 6; rerun()
+            st.markdown("---")
+            st.caption("Custom / History")
+            custom_list = get_custom_combos()
+            display_custom = [c for c in custom_list if c not in ALL_FIXED_COMBOS][:4]
+            if display_custom:
+                r3 = st.columns(2)
+                for i, c in enumerate(display_custom):
+                    if r3[i%2].button(c, use_container_width=True): st.session_state.current_input_data['combo'] = c; st.session_state.scout_step = 6; rerun()
+            c_val = st.text_input("Type new combo")
+            if st.button("Add & Next", use_container_width=True):
+                if c_val: st.session_state.current_input_data['combo'] = c_val; st.session_state.scout_step = 6; rerun()
+            if st.button("🔙 Back", use_container_width=True): st.session_state.scout_step = 4; rerun()
+
+        elif st.session_state.scout_step == 6:
+            st.markdown('<div class="step-header">6. Quality</div>', unsafe_allow_html=True)
+            q_cols = st.columns(2)
+            with q_cols[0]:
+                if st.button("# Perfect", use_container_width=True): commit_record("#")
+                if st.button('! OK', use_container_width=True): commit_record('!')
+                if st.button("- ワンチ", use_container_width=True): commit_record("-")
+            with q_cols[1]:
+                if st.button("T BlockOut", use_container_width=True): commit_record("T")
+                if st.button('" Good', use_container_width=True): commit_record('"')
+                if st.button("/ Rebound", use_container_width=True): commit_record("/")
+            if st.button("^ シャット/ミス", use_container_width=True): commit_record("^")
+            st.markdown("---")
+            if st.button("🔙 Back (Map/Combo)", use_container_width=True):
+                st.session_state.scout_step = 5 if needs_combo() else 4
+                st.session_state.points = []; st.session_state.key_map += 1; rerun()
+
+        st.markdown("</div>", unsafe_allow_html=True)
+        if st.button("🔄 Reset Input", use_container_width=True):
+            st.session_state.scout_step = 0; st.session_state.points = []; rerun()
+
+    st.markdown("### Data Log")
+    u1, u2 = st.columns(2)
+    if u1.button("↩️ Undo Last", use_container_width=True): undo_last_action()
+    if u2.button("↪️ Redo", use_container_width=True): redo_last_action()
+    if len(st.session_state.data_log) > 0:
+        st.dataframe(st.session_state.data_log.reversed_frame(), height=150)
+        c1, c2 = st.columns(2)
+        with c1:
+            with st.expander("選手交代 / リベロ"):
+                lu = st.session_state.lineup
+                out_p = st.selectbox("OUT", st.session_state.rotation)
+                in_p = st.text_input("IN Name")
+                if st.button("Change", use_container_width=True):
+                    if in_p and in_p not in st.session_state.all_players:
+                        st.session_state.all_players.append(in_p)
+                    # ★ リベロの入れ替えは交代回数に数えない（前衛に上がる時は下がっていた選手に自動で戻す）
+                    push_event({'k': 'sub', 'out': out_p, 'in': in_p, 'libero': in_p in st.session_state.liberos}); auto_save()
+                    rerun()
+                st.caption(f"交代 {len(lu['subs'])}回" + "".join(f"　{o}→{i}" for o, i in lu['subs']))
+                if lu['libero']: st.caption("リベロ: " + "　".join(f"{l}（{p}）" for l, p in lu['libero'].items()))
+        with c2:
+            st.markdown("#### Download")
+            c_fmt, c_btn = st.columns(2)
+            with c_fmt: fmt = st.radio("Format", [".xlsx", ".csv"], horizontal=True)
+            with c_btn:
+                # ★ ファイル名をセット名と合わせる（ファイル名に使えない文字は _ に置換）
+                #   終了したセットがあれば試合全体（最初のセット〜今のセット）をまとめて書き出す
+                names = [e["set_name"] for e in st.session_state.sets[:1]] + [st.session_state.set_name]
+                safe_set = "-".join(re.sub(r'[\\/:*?"<>|\s]', '_', str(n)) for n in dict.fromkeys(names)) or "1"
+                fname = f"scout_set{safe_set}"
+                # ★ 中身はボタンが押された時に初めて作る（ログが変わるまでキャッシュを使い回す）
+                build = functools.partial(export.export_bytes, st.session_state.data_log,
+                                          st.session_state.game_id, fmt, st.session_state.export_cache,
+                                          st.session_state.sets)
+                st.download_button(f"📥 {fmt[1:].upper()}", build, f"{fname}{fmt}", export.MIME[fmt])
+                export.prebuild(st.session_state.data_log, st.session_state.game_id, fmt,
+                                st.session_state.export_cache, st.session_state.sets)
+
+    # ★ この試合の集計（記録・Undoのたびに差分で更新済みの集計を表にするだけ）
+    with st.expander("📊 この試合の集計"):
+        agg = st.session_state.aggregates
+        a1, a2 = st.columns(2)
+        with a1:
+            # 記録行から数えるので My/Op Point ボタンの得点は入らない（上の Sideout/Break はイベント列から数えるので入る）
+            st.caption("ローテ(①の選手) × 局面 の得点率（記録行で終わったラリーのみ。R=サイドアウト / S=ブレイク）")
+            st.dataframe(agg.rotation_phase())
+            st.caption("コンビ別")
+            st.dataframe(agg.combo_usage())
+        with a2:
+            st.caption("選手 × スキル × 評価")
+            st.dataframe(agg.player_skill_quality())
+        # ★ 打球チャート（ONの時だけ描く。ログと絞り込みが同じ間は描いた画像を使い回す）
+        if st.toggle("打球チャートを表示", key="show_charts"):
+            log = st.session_state.data_log
+            f1, f2 = st.columns(2)
+            with f1: c_skill = st.selectbox("スキル", ["A", "S", "B", "R", "D", "E"], key="chart_skill")
+            with f2: c_player = st.selectbox("選手", ["全員"] + sorted({p for p in log.columns.get('player', []) if isinstance(p, str) and p}), key="chart_player")
+            key = (st.session_state.game_id, log.version, len(log), c_skill, c_player)
+            if st.session_state.chart_cache.get('key') != key:
+                import court
+                d = analytics.clean(log.frame(), ['player', 'skill'] + analytics.COORDS)
+                d = d[d['skill'] == c_skill]
+                if c_player != "全員": d = d[d['player'] == c_player]
+                st.session_state.chart_cache = {'key': key, 'n': len(d),
+                    'spray': court.spray_chart(d['start_x'], d['start_y'], d['end_x'], d['end_y']),
+                    'heat': court.heatmap(d['end_x'], d['end_y'])}
+            cache = st.session_state.chart_cache
+            st.caption(f"{cache['n']} 本")
+            h1, h2 = st.columns(2)
+            with h1: st.image(cache['spray'], caption="始点→終点")
+            with h2: st.image(cache['heat'], caption="終点の密度")
+
+    # ★ セット終了: このセットを凍結して次のセットへ（終了したセットは保存し直さない）
+    with st.expander(f"🏁 セット終了（終了済み {len(st.session_state.sets)} セット）"):
+        for e in st.session_state.sets:
+            st.caption(f"Set{e['set_name']}  {e['score'][0]}-{e['score'][1]}  ({e['rows']}行)")
+        if st.button(f"Set{st.session_state.set_name} を終了して次のセットへ", use_container_width=True):
+            finish_set()
+            st.toast("セットを保存しました。次のセットのラインナップを入力してください", icon="🏁")
+            rerun()
+
+    # ★ 予備機能: ローテがずれた時の手動補正
+    st.divider()
+    with st.expander("🔧 予備機能（ローテ手動補正）"):
+        st.caption("ローテが途中でずれてしまった時の応急処置です。スコアは変えずにローテーションだけ1つ回します。①〜⑥はコート上のローテ位置（背番号ではありません）。")
+        rot_grid(st.session_state.lineup)
+        if st.button("🔄 ローテを一つ回す", use_container_width=True):
+            rotate_team()
+            st.toast("ローテを1つ回しました", icon="🔄")
+            rerun()
+
+# ★ リランせずに終わった場合の保存（SAVE_IDLE_SEC 内なら次回に持ち越す）
+flush_save()
+profiler.end_rerun()
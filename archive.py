@@ -0,0 +1,274 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import closing
+import clips
+import game_index
+import lineup
+import storage
+from datalog import DataLog
+from events import EventLog, position_columns, row_count
+
+# ★ 保存ディレクトリの整理（更新の止まった試合を1ファイルに固めて退避・古い退避分の削除・残骸の掃除）
+#   退避: 凍結セット + 進行中のセット + イベント列を autosave_archive/{ID}.json.gz 1つにまとめ、元の保存ファイルは消す
+#         同じ文字列が続く列（動画URL・選手名等）は 値の表 + 番号 に、pos1〜pos6 はイベント列から作り直せる時は外す
+#   目録: 退避した試合を manifest.sqlite に1行ずつ（ID・選手名・動画URLで検索できる）。IDゲートの一覧・索引は生きている試合だけになる
+#   退避済みのIDを開くと復元してから再開する（restore）
+#   python archive.py [--older-than 7] [--max-age-days N] [--max-mb N] [--clean] [--dry-run]
+#   python archive.py --restore ID / --search 文字列
+ARCHIVE_DIR = "autosave_archive"
+MANIFEST_FILE = os.path.join(ARCHIVE_DIR, "manifest.sqlite")
+ARCHIVE_AFTER_DAYS = 7   # この日数更新の無い試合を退避する
+ORPHAN_SEC = 24 * 3600   # 状態ファイルの無いロック・書きかけの一時ファイルをこの秒数過ぎたら消す
+FORMAT_VERSION = 1
+
+def archive_file(game_id):
+    return os.path.join(ARCHIVE_DIR, f"{game_id}.json.gz")
+
+def archived(game_id):
+    return os.path.exists(archive_file(game_id))
+
+def _connect():
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    con = sqlite3.connect(MANIFEST_FILE, timeout=5)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("""CREATE TABLE IF NOT EXISTS archived (
+        game_id TEXT PRIMARY KEY, sets TEXT, rows INTEGER, updated REAL, archived REAL, bytes INTEGER,
+        players TEXT, video_urls TEXT)""")
+    con.execute("CREATE INDEX IF NOT EXISTS archived_updated ON archived(updated)")
+    return con
+
+# ★ 目録を読むだけ（まだ何も退避していなければ空。ディレクトリも目録も作らない）
+def _query(sql, args=()):
+    if not os.path.exists(MANIFEST_FILE):
+        return []
+    with closing(_connect()) as con:
+        con.row_factory = sqlite3.Row
+        return con.execute(sql, args).fetchall()
+
+def _events(d):
+    return None if d is None else {k: v for k, v in d.items() if k != "checkpoints"}  # チェックポイントは復元時に作り直す
+
+def _nan(v):
+    return type(v) is float and v != v
+
+# ★ 列を詰める。文字列（と CSV の空欄の NaN）だけの列で種類が行数の半分以下なら {"values": [...], "codes": [...]}
+#   pos1〜pos6 はイベント列からの再計算と全行一致する時だけ外す（"positions": "events"）
+def _pack(columns, length, elog):
+    cols = dict(columns)
+    derived = (elog is not None and "pos1" in cols and row_count(elog) == length
+               and position_columns(elog) == {c: cols.get(c) for c in lineup.POS_COLUMNS})
+    if derived:
+        for c in lineup.POS_COLUMNS: del cols[c]
+    out = {}
+    for c, col in cols.items():
+        if col and all(type(v) is str or _nan(v) for v in col):
+            at = {}
+            codes = [at.setdefault(None if _nan(v) else v, len(at)) for v in col]
+            if len(at) * 2 <= len(col):
+                out[c] = {"values": list(at), "codes": codes}
+                continue
+        out[c] = col
+    return {"columns": out, "length": length, "positions": "events" if derived else "columns"}
+
+def _unpack(packed, elog):
+    rows = DataLog()
+    for c, col in packed["columns"].items():
+        if isinstance(col, dict):
+            values = [float("nan") if v is None else v for v in col["values"]]
+            col = [values[i] for i in col["codes"]]
+        rows.columns[c] = col
+    rows.length = packed["length"]
+    if packed["positions"] == "events":
+        storage.restamp(rows, elog)
+    return rows
+
+def _read_set_body(entry):
+    with open(entry["file"], "rb") as f:
+        return json.loads(gzip.decompress(f.read()))
+
+def _strings(rows, column):
+    return [v for v in dict.fromkeys(rows.columns.get(column, [])) if type(v) is str and v]
+
+# ★ 試合1つ分の退避ファイルの中身と目録の1行を作る（seq は読んだ時点の journal.seq）
+def _build(game_id, seq, updated, rows, state, elog):
+    body = {"version": FORMAT_VERSION, "game_id": game_id, "updated": updated, "seq": seq,
+            "format": storage.snapshot_format(game_id),
+            "state": state, "sets": [], "active": None}
+    players, urls, names, total = [], [], [], 0
+    for entry in state.get("sets", []):
+        s = _read_set_body(entry)
+        s_elog = EventLog.from_dict(s["events"]) if s.get("events") else None
+        s_rows = DataLog()
+        s_rows.columns, s_rows.length = s["columns"], s["length"]
+        body["sets"].append({"entry": entry, "set_name": s["set_name"], "state": s["state"],
+                             "events": _events(s.get("events")), "data": _pack(s["columns"], s["length"], s_elog)})
+        players += _strings(s_rows, "player"); urls += _strings(s_rows, "video_url")
+        names.append(f"{entry['set_name']}:{entry['score'][0]}-{entry['score'][1]}"); total += s["length"]
+    body["active"] = {"events": _events(elog.to_dict()) if elog is not None else None,
+                      "data": _pack(rows.columns, len(rows), elog)}
+    players += _strings(rows, "player") + state.get("all_players", [])
+    urls += _strings(rows, "video_url") + ([state["video_url"]] if state.get("video_url") else [])
+    score = state.get("score", [0, 0])
+    names.append(f"{state.get('set_name', '')}:{score[0]}-{score[1]}"); total += len(rows)
+    row = {"game_id": game_id, "sets": " / ".join(names), "rows": total, "updated": updated,
+           "players": " | ".join(dict.fromkeys(players)), "video_urls": " | ".join(dict.fromkeys(urls))}
+    return body, row
+
+def _write_archive(path, body):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    data = gzip.compress(json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    storage.atomic_write(path, lambda f: f.write(data), binary=True)
+    return len(data)
+
+def _lengths(body):
+    return [s["data"]["length"] for s in body["sets"]] + [body["active"]["data"]["length"]]
+
+def _load_archive(game_id):
+    with open(archive_file(game_id), "rb") as f:
+        return json.loads(gzip.decompress(f.read()))
+
+# ★ 試合1つを退避する。保存を読む → 退避ファイル → 目録 まで済んだら Journal.retire が元の保存ファイルを消して索引から外す
+#   退避ファイルを読み直して行数が合わなければ例外にして元ファイルは消さない。退避した試合の (目録の1行, バイト数) を返す
+def archive_game(game_id, dry_run=False):
+    hit, sf = game_index.lookup(game_id), storage.state_file(game_id)
+    updated = hit[4] if hit else os.path.getmtime(sf) if os.path.exists(sf) else time.time()
+    journal = storage.Journal(game_id)
+    if dry_run:
+        loaded = journal.load(claim=False)
+        return loaded and (_build(game_id, journal.seq, updated, *loaded)[1], 0)
+
+    def keep(rows, state, elog):
+        body, row = _build(game_id, journal.seq, updated, rows, state, elog)
+        size = _write_archive(archive_file(game_id), body)
+        if _lengths(_load_archive(game_id)) != _lengths(body):
+            os.remove(archive_file(game_id))
+            raise ValueError(f"{game_id}: 退避ファイルの読み直しで行数が一致しません")
+        with closing(_connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO archived VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (game_id, row["sets"], row["rows"], updated, time.time(), size, row["players"], row["video_urls"]))
+        return row, size
+    out = journal.retire(keep)
+    if out: clips.forget(game_id)
+    return out
+
+# ★ older_than_days 日以上更新の無い試合をまとめて退避する（背景の保存が残っている試合・skip のIDは飛ばす）
+def archive_inactive(older_than_days=ARCHIVE_AFTER_DAYS, skip=(), dry_run=False):
+    game_index.ensure_index()
+    limit = time.time() - older_than_days * 86400
+    done = []
+    for gid, _, _, _, updated in game_index.list_games(page_size=-1):
+        if updated < limit and gid not in skip and not storage.saving(gid):
+            out = archive_game(gid, dry_run)
+            if out: done.append(out)
+    return done
+
+# ★ 退避ファイルから保存ファイルを書き戻して目録から外す。退避されていなければ False
+def restore(game_id):
+    if not archived(game_id):
+        return False
+    body = _load_archive(game_id)
+    if os.path.exists(storage.state_file(game_id)):
+        raise FileExistsError(storage.state_file(game_id))  # 退避後に同じIDで新しく保存された
+    entries = []
+    for s in body["sets"]:
+        s_elog = EventLog.from_dict(s["events"]) if s["events"] else None
+        entries.append(storage.write_set(game_id, s["entry"]["n"], _unpack(s["data"], s_elog), s["state"], s_elog))
+    active = body["active"]
+    elog = EventLog.from_dict(active["events"]) if active["events"] else None
+    rows = _unpack(active["data"], elog)
+    state = dict(body["state"], sets=entries)
+    storage.Journal(game_id).create(rows, state, elog, body["format"], body["seq"])
+    game_index.upsert(game_id, state.get("set_name", ""), state.get("score", [0, 0]), len(rows), body["updated"])
+    with closing(_connect()) as con, con:
+        con.execute("DELETE FROM archived WHERE game_id = ?", (game_id,))
+    os.remove(archive_file(game_id))
+    return True
+
+# ★ 目録の検索（ID・選手名・動画URLの部分一致）。新しい順に dict のリスト
+def search(query="", limit=30):
+    q = f"%{query}%"
+    return [dict(r) for r in _query("""SELECT game_id, sets, rows, updated, archived, bytes FROM archived
+        WHERE game_id LIKE ? OR players LIKE ? OR video_urls LIKE ? ORDER BY updated DESC LIMIT ?""", (q, q, q, limit))]
+
+# ★ ディスク使用量: (生きている保存のバイト数, 退避ファイルのバイト数, 退避件数)。退避分は目録から引く
+#   生きている保存は保存ディレクトリを走査するので、画面では押された時だけ呼ぶ
+def usage():
+    live = sum(os.path.getsize(p) for p in glob.glob("autosave_*") if os.path.isfile(p))
+    n, size = (_query("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM archived") or [(0, 0)])[0]
+    return live, size, n
+
+# ★ 退避分の削除（元に戻せない）。max_age_days: 最終更新がそれより古い退避分 / max_bytes: 保存全体がそれを超える間、古い順に
+#   消した (ID, バイト数) のリストを返す
+def evict(max_age_days=None, max_bytes=None, dry_run=False):
+    items = _query("SELECT game_id, updated, bytes FROM archived ORDER BY updated")
+    live, total, _ = usage()
+    total += live
+    limit = time.time() - max_age_days * 86400 if max_age_days else None
+    out = []
+    for gid, updated, size in items:
+        if not ((limit and updated < limit) or (max_bytes and total > max_bytes)):
+            continue
+        if not dry_run:
+            if archived(gid): os.remove(archive_file(gid))
+            with closing(_connect()) as con, con:
+                con.execute("DELETE FROM archived WHERE game_id = ?", (gid,))
+        total -= size
+        out.append((gid, size))
+    return out
+
+# ★ 残骸の掃除: 状態ファイルの無いIDのロック・ジャーナル・凍結セット・スナップショット、落ちた書き込みの一時ファイル
+#   （IDを開いただけで作られるロックファイル等）。min_age 秒より新しい物は書き込み中かもしれないので残す
+def clean(min_age=ORPHAN_SEC, dry_run=False):
+    now = time.time()
+    pattern = re.compile(r"autosave_(?:(?:data|journal)_(?P<a>.+?)\.(?:csv|arrow|jsonl)|set_(?P<b>.+?)_\d+\.json\.gz|(?P<c>[^_]+)\.lock)")
+    removed = []
+    for p in glob.glob("autosave_*") + glob.glob(os.path.join(ARCHIVE_DIR, "*.tmp")):
+        if not os.path.isfile(p) or now - os.path.getmtime(p) < min_age:
+            continue
+        name = os.path.basename(p)
+        m = pattern.fullmatch(name)
+        gid = m and (m["a"] or m["b"] or m["c"])
+        if name.endswith(".tmp") or (gid and not os.path.exists(storage.state_file(gid))):
+            if not dry_run: os.remove(p)
+            removed.append(p)
+    return removed
+
+def mb(n):
+    return f"{n / 1e6:.1f} MB"
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="保存データの退避・削除・掃除")
+    ap.add_argument("--older-than", type=float, default=ARCHIVE_AFTER_DAYS, help="この日数更新の無い試合を退避する（0: 退避しない）")
+    ap.add_argument("--max-age-days", type=float, help="最終更新がこの日数より古い退避分を削除する")
+    ap.add_argument("--max-mb", type=float, help="保存全体がこのサイズを超えないよう古い退避分から削除する")
+    ap.add_argument("--clean", action="store_true", help="状態ファイルの無いIDの残骸と一時ファイルを消す")
+    ap.add_argument("--restore", metavar="ID", help="退避した試合を元に戻す")
+    ap.add_argument("--search", metavar="TEXT", help="退避した試合を ID・選手名・動画URL で探す")
+    ap.add_argument("--dry-run", action="store_true", help="何をするかだけ表示する")
+    args = ap.parse_args()
+    if args.restore:
+        ok = restore(args.restore)
+        print(f"{args.restore}: {'復元しました' if ok else '退避されていません'}")
+        sys.exit(0 if ok else 1)
+    if args.search is not None:
+        for r in search(args.search, limit=-1):
+            print(f"{r['game_id']}  {time.strftime('%Y-%m-%d', time.localtime(r['updated']))}  {r['sets']}  {r['rows']}行  {mb(r['bytes'])}")
+        sys.exit(0)
+    if args.clean:
+        for p in clean(dry_run=args.dry_run):
+            print(f"掃除  {p}")
+    if args.older_than:
+        for row, size in archive_inactive(args.older_than, dry_run=args.dry_run):
+            print(f"退避  {row['game_id']}  {row['sets']}  {row['rows']}行" + (f"  -> {mb(size)}" if size else ""))
+    if args.max_age_days or args.max_mb:
+        for gid, size in evict(args.max_age_days, args.max_mb and args.max_mb * 1e6, args.dry_run):
+            print(f"削除  {gid}  {mb(size)}")
+    live, size, n = usage()
+    print(f"保存 {mb(live)} / 退避 {n}件 {mb(size)}", file=sys.stderr)
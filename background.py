@@ -0,0 +1,84 @@
+import atexit
+import queue
+import threading
+import time
+
+# ★ 記録画面の外で動かす処理（保存・書き出しの先回り生成）
+#   キー（例: "save:12345"）ごとにスレッド1本と上限付きキューを持つ。同じキーの仕事は投入順に1つずつ実行する
+#   キューが一杯なら submit() が空くまで待つ（書き込みが追い付かない時はタップ側を待たせる）
+#   LANE_IDLE_SEC 秒仕事が来なければスレッドを終えて列を外す（シーズン中に開いた試合の数だけスレッドが残らない）
+#   終了時（atexit）には全キーの残りを実行し切る
+QUEUE_MAX = 64
+LANE_IDLE_SEC = 30.0
+
+_lanes = {}
+_errors = {}  # キー → 仕事の中で捕まえなかった例外（列を外した後も呼び出し側が見られるように列の外に置く）
+_lock = threading.Lock()
+
+class Lane:
+    def __init__(self, key):
+        self.key = key
+        self.jobs = queue.Queue(QUEUE_MAX)
+        self.users = 0  # submit() の途中（列を選んでから put し終わるまで）の数。0 でないうちは外さない
+        self.thread = threading.Thread(target=self._run, name=f"lane-{key}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                fn, args = self.jobs.get(timeout=LANE_IDLE_SEC)
+            except queue.Empty:
+                with _lock:
+                    if self.users == 0 and self.jobs.empty():
+                        del _lanes[self.key]
+                        return
+                continue
+            try:
+                fn(*args)
+            except Exception as e:
+                _errors.setdefault(self.key, []).append(e)
+            finally:
+                self.jobs.task_done()
+
+    def pending(self):
+        return self.jobs.unfinished_tasks
+
+def submit(key, fn, *args):
+    with _lock:
+        if key not in _lanes:
+            _lanes[key] = Lane(key)
+        ln = _lanes[key]
+        ln.users += 1
+    try:
+        ln.jobs.put((fn, args))
+    finally:
+        with _lock:
+            ln.users -= 1
+
+# ★ そのキーの仕事が残っていないか（残っていなければロックも取らずにすぐ返る）
+def idle(key):
+    ln = _lanes.get(key)
+    return ln is None or ln.pending() == 0
+
+# ★ そのキーの投入済みの仕事が全部終わるまで待つ（読み直しの前など）
+def drain(key):
+    ln = _lanes.get(key)
+    if ln is not None:
+        ln.jobs.join()
+
+def drain_all():
+    for ln in list(_lanes.values()):
+        ln.jobs.join()
+
+def errors(key):
+    return _errors.pop(key, [])
+
+# ★ delay 秒待ってから still() が真の時だけ fn を実行する（入力が止まってからの先回り生成用）
+def submit_idle(key, delay, still, fn, *args):
+    def job():
+        time.sleep(delay)
+        if still():
+            fn(*args)
+    submit(key, job)
+
+atexit.register(drain_all)
@@ -0,0 +1,237 @@
+import argparse
+import ast
+import copy
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# ★ 記録操作のベンチマーク（Streamlit無しで app.py の関数をそのまま動かす）
+#   python bench.py [--rallies 500] [--every 100] [--memory] [--json out.json] [--sync]
+#   python bench.py --startup [--runs 5]   IDゲート初回表示の起動時間を測る（予算超過・重いモジュール読込で終了コード1）
+#   app.py から import 文・defaults・関数定義だけを取り出し、st をスタブに差し替えて実行する
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+SKIP_IMPORTS = {"streamlit", "streamlit_image_coordinates"}
+
+# ★ 起動予算: 新しいプロセスで IDゲートを1回描くまで（streamlit 本体の import は別に表示）
+STARTUP_BUDGET_MS = 1000
+HEAVY = ("pandas", "numpy", "matplotlib", "PIL", "pyarrow", "xlsxwriter", "streamlit_image_coordinates")
+_STARTUP = """
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+t2 = time.perf_counter()
+print(json.dumps({"streamlit_ms": (t1 - t0) * 1000, "gate_ms": (t2 - t1) * 1000, "ok": not at.exception,
+                  "heavy": [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+class Session(dict):
+    def __getattr__(self, k):
+        try:
+            return self[k]
+        except KeyError:
+            raise AttributeError(k)
+
+    def __setattr__(self, k, v):
+        self[k] = v
+
+class StStub:
+    def __init__(self):
+        self.session_state = Session()
+
+    def _noop(self, *a, **kw):
+        pass
+
+    toast = warning = rerun = _noop
+
+def load_app(st):
+    tree = ast.parse(open(APP, encoding="utf-8").read())
+    keep = []
+    for node in tree.body:
+        if isinstance(node, ast.Import) and not any(a.name in SKIP_IMPORTS for a in node.names):
+            keep.append(node)
+        elif isinstance(node, ast.ImportFrom) and node.module not in SKIP_IMPORTS:
+            keep.append(node)
+        elif isinstance(node, ast.FunctionDef):
+            keep.append(node)
+        elif isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "defaults" for t in node.targets):
+            keep.append(node)
+    ns = {"st": st, "__name__": "app_bench"}
+    exec(compile(ast.Module(keep, []), APP, "exec"), ns)
+    return ns
+
+# ★ /proc/self/io があればプロセス全体の書き込みバイト数、無ければ保存ファイルの合計サイズ
+def bytes_written(workdir):
+    try:
+        with open("/proc/self/io") as f:
+            return int(next(l for l in f if l.startswith("wchar")).split()[1])
+    except (OSError, StopIteration):
+        return sum(os.path.getsize(os.path.join(workdir, n)) for n in os.listdir(workdir))
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def pct(values, p):
+    if not values: return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
+
+class Bench:
+    def __init__(self, ns, seed=0):
+        self.ns, self.st = ns, ns["st"]
+        self.rnd = random.Random(seed)
+        self.times = {}
+        ss = self.st.session_state
+        ss.update(copy.deepcopy(ns["defaults"]))
+        ss.game_id = f"bench{seed}"
+        ss.all_players = [f"P{i}" for i in range(1, 13)]
+        ss.rotation = ss.all_players[:6]
+        ss.liberos = ["P12"]
+        ss.phase = "R"; ss.stage = 6
+        ns["start_match"](ss)
+        ns["rerun"]()
+        court.court_background()  # 初回のみの描画・フォント読み込みは測定から外す
+
+    def timed(self, name, fn, *args):
+        t = time.perf_counter()
+        out = fn(*args)
+        self.times.setdefault(name, []).append((time.perf_counter() - t) * 1000)
+        return out
+
+    def _tap_points(self):
+        ns, rnd = self.ns, self.rnd
+        pts = []
+        for _ in range(rnd.choice([0, 1, 2, 2])):
+            lx, ly = rnd.uniform(-1, 10), rnd.uniform(-1, 19)
+            pts.append((*court.to_px(lx, ly), lx, ly))
+            self.timed("create_court_img", court.create_court_img, list(pts))
+        return pts
+
+    def record(self, skill, quality, **extra):
+        ss = self.st.session_state
+        ss.current_input_data = dict(skill=skill, player=self.rnd.choice(ss.all_players[:6]),
+                                     time=str(self.rnd.randint(0, 5959)), **extra)
+        ss.points = self._tap_points()
+        self.timed("commit_record", self.ns["commit_record"], quality)
+
+    def rally(self):
+        ss, rnd = self.st.session_state, self.rnd
+        if ss.phase == "S":
+            self.record("S", rnd.choice(["#", "^", "!", "!", "!", "-"]))
+        else:
+            self.record("R", rnd.choice(["#", "!", "/", "-"]))
+        if events_winner(ss) is None:
+            setter = rnd.choice(ss.all_players[:6])
+            self.record("A", rnd.choice(["#", "#", "T", "!", "^", "-"]), setter=setter,
+                        combo=rnd.choice(["A", "B", "C", "レフト", "ライト"]), att_phase=rnd.choice("RTC"))
+            if events_winner(ss) is None:
+                self.timed("update_score", self.ns["update_score"], rnd.choice(["my", "op"]))
+                self.timed("auto_save", self.ns["rerun"])
+        if rnd.random() < 0.05:
+            self.timed("undo_last_action", self.ns["undo_last_action"])
+            self.timed("redo_last_action", self.ns["redo_last_action"])
+        if rnd.random() < 0.01:
+            self.timed("rotate_team", self.ns["rotate_team"])
+            self.timed("auto_save", self.ns["rerun"])
+
+def events_winner(ss):
+    # 直前のイベントで得点が入ったか（ラリー終了）
+    ev = ss.event_log.events[-1] if ss.event_log.events else {}
+    return ev.get("w") or None
+
+def startup(runs):
+    workdir = tempfile.mkdtemp(prefix="scout_startup_")
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _STARTUP, APP, *HEAVY], cwd=workdir,
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    gate = statistics.median(r["gate_ms"] for r in results)
+    heavy = sorted({m for r in results for m in r["heavy"]})
+    print(f"streamlit import {statistics.median(r['streamlit_ms'] for r in results):.0f} ms  "
+          f"gate first run {gate:.0f} ms (budget {STARTUP_BUDGET_MS} ms, median of {runs})")
+    print(f"heavy modules loaded at the gate: {', '.join(heavy) or 'none'}")
+    ok = gate <= STARTUP_BUDGET_MS and not heavy and all(r["ok"] for r in results)
+    print("OK" if ok else "OVER BUDGET")
+    return ok
+
+def summarize(times):
+    return {name: {"n": len(v), "p50": round(pct(v, 50), 3), "p95": round(pct(v, 95), 3),
+                   "p99": round(pct(v, 99), 3), "max": round(max(v), 3), "mean": round(statistics.fmean(v), 3)}
+            for name, v in sorted(times.items()) if v}
+
+def main():
+    ap = argparse.ArgumentParser(description="記録操作のレイテンシ・書き込み量・メモリを測る")
+    ap.add_argument("--rallies", type=int, default=500)
+    ap.add_argument("--sets", type=int, default=5)
+    ap.add_argument("--every", type=int, default=100, help="何ラリーごとに区間集計を出すか")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--dir", help="保存先（省略時は一時ディレクトリ）")
+    ap.add_argument("--memory", action="store_true", help="tracemalloc で Python ヒープのピークも測る（遅くなる）")
+    ap.add_argument("--json", help="結果をJSONで書き出す")
+    ap.add_argument("--think", type=float, default=0.0, help="ラリー間の待ち（ミリ秒、計測外）。背景の保存はこの間に進む")
+    ap.add_argument("--sync", action="store_true", help="保存を背景スレッドに渡さずリランの中で書き切る（従来の動き）")
+    ap.add_argument("--startup", action="store_true", help="IDゲートの起動時間だけを測る")
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+    if args.startup:
+        sys.exit(0 if startup(args.runs) else 1)
+
+    sys.path.insert(0, os.path.dirname(APP))
+    out_json = os.path.abspath(args.json) if args.json else None
+    workdir = args.dir or tempfile.mkdtemp(prefix="scout_bench_")
+    os.chdir(workdir)
+    if args.memory:
+        tracemalloc.start()
+    global court
+    import court
+    import storage
+    storage.ASYNC_SAVE = not args.sync
+    ns = load_app(StStub())
+    bench = Bench(ns, args.seed)
+    ss = bench.st.session_state
+    per_set = max(1, args.rallies // args.sets)
+    windows = []
+    start_w, start_t = bytes_written(workdir), time.perf_counter()
+    for i in range(1, args.rallies + 1):
+        if i > 1 and (i - 1) % per_set == 0:
+            bench.timed("finish_set", ns["finish_set"])
+            ss.rotation = ss.all_players[:6]; ss.phase = "R"; ss.stage = 6
+            ns["start_match"](ss)
+            ns["rerun"]()
+        bench.rally()
+        if args.think: time.sleep(args.think / 1000)
+        if i % args.every == 0 or i == args.rallies:
+            storage.drain(ss.game_id)  # 背景の保存の分も区間に含める
+            w = bytes_written(workdir)
+            win = {"rallies": i, "rows": len(ss.data_log), "events": len(ss.event_log.events),
+                   "bytes_written": w - start_w, "seconds": round(time.perf_counter() - start_t, 3),
+                   "peak_rss_mb": round(peak_rss_mb(), 1), "ops": summarize(bench.times)}
+            if args.memory:
+                win["peak_heap_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+                tracemalloc.reset_peak()
+            windows.append(win)
+            print(f"-- rallies {i}  rows {win['rows']}  written {win['bytes_written'] / 1024:.0f} KiB  "
+                  f"rss {win['peak_rss_mb']} MB" + (f"  heap {win['peak_heap_mb']} MB" if args.memory else ""))
+            for name, s in win["ops"].items():
+                print(f"   {name:<18} n={s['n']:<5} p50={s['p50']:7.2f}ms  p95={s['p95']:7.2f}ms  "
+                      f"p99={s['p99']:7.2f}ms  max={s['max']:7.2f}ms")
+            bench.times = {}
+            start_w, start_t = bytes_written(workdir), time.perf_counter()
+    files = {n: os.path.getsize(n) for n in sorted(os.listdir(workdir))}
+    print(f"files in {workdir}: " + ", ".join(f"{n} {s / 1024:.0f} KiB" for n, s in files.items()))
+    if out_json:
+        with open(out_json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "windows": windows, "files": files}, f, ensure_ascii=False, indent=1)
+
+if __name__ == "__main__":
+    main()
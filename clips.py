@@ -0,0 +1,165 @@
+import argparse
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# ★ 全試合の記録行の動画時刻インデックス（映像確認用のクリップ一覧・チャプターを作る）
+#   (game_id, video_time) 順の表に 選手・スキル・評価・ゾーン の索引を張る。絞り込みは索引を引くだけで全行を走査しない
+#   試合ごとに game_index の更新時刻とジャーナルの seq を覚えておき、変わった試合だけ入れ直す
+#   python clips.py [--player 名前] [--skill R] [--quality ^] [--zone 5] [--game ID] [--format m3u|chapters|csv] [--lead 3]
+CLIPS_FILE = "autosave_clips.sqlite"
+FILTERS = ("game_id", "player", "skill", "quality", "end_zone", "start_zone", "set_name", "phase")
+LEAD_SEC = 3  # クリップの頭出しを少し前から
+
+def _connect():
+    con = sqlite3.connect(CLIPS_FILE, timeout=5)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("""CREATE TABLE IF NOT EXISTS clips (
+        game_id TEXT, n INTEGER, set_name TEXT, video_url TEXT, video_time INTEGER, phase TEXT,
+        player TEXT, skill TEXT, quality TEXT, combo TEXT, start_zone TEXT, end_zone TEXT, score TEXT,
+        PRIMARY KEY (game_id, video_time, n))""")
+    for col in ("player", "skill", "quality", "end_zone"):
+        con.execute(f"CREATE INDEX IF NOT EXISTS clips_{col} ON clips({col}, game_id, video_time, n)")
+    con.execute("CREATE INDEX IF NOT EXISTS clips_skill_quality ON clips(skill, quality, game_id, video_time, n)")
+    con.execute("CREATE TABLE IF NOT EXISTS indexed (game_id TEXT PRIMARY KEY, updated REAL, seq INTEGER)")
+    return con
+
+def _text(v):
+    return "" if v is None or (isinstance(v, float) and v != v) else str(v)
+
+def _sec(v):
+    try:
+        return int(float(v))
+    except (TypeError, ValueError):
+        return 0
+
+COLUMNS = ["set", "score", "phase", "player", "skill", "quality", "combo", "start_zone", "end_zone", "video_url", "video_time"]
+
+def _rows(game_id):
+    import storage
+    loaded = storage.Journal(game_id).load(claim=False, columns=COLUMNS)
+    if loaded is None:
+        return []
+    log = storage.match_log(loaded[1].get("sets", []), loaded[0], COLUMNS)
+    c = log.columns
+    col = lambda k: c.get(k, [""] * len(log))
+    return [(game_id, i, _text(s), _text(u), _sec(t), _text(ph), _text(p), _text(sk), _text(q), _text(cb),
+             _text(sz), _text(ez), _text(sc))
+            for i, (s, u, t, ph, p, sk, q, cb, sz, ez, sc) in enumerate(zip(
+                col("set"), col("video_url"), col("video_time"), col("phase"), col("player"), col("skill"),
+                col("quality"), col("combo"), col("start_zone"), col("end_zone"), col("score")))]
+
+# ★ 索引を保存データに追従させる（更新時刻か seq が変わった試合・消えた試合だけ処理）。入れ直した試合数を返す
+#   seq も見るのは zones.py の再判定（rewrite_rows）が game_index を更新しないため
+def refresh():
+    import game_index
+    import storage
+    game_index.ensure_index()
+    games = {gid: (updated, storage.head_seq(gid)) for gid, _, _, _, updated in game_index.list_games(page_size=-1)}
+    with closing(_connect()) as con, con:
+        known = {gid: (updated, seq) for gid, updated, seq in con.execute("SELECT game_id, updated, seq FROM indexed")}
+        for gid in set(known) - set(games):
+            con.execute("DELETE FROM clips WHERE game_id = ?", (gid,))
+            con.execute("DELETE FROM indexed WHERE game_id = ?", (gid,))
+        changed = [gid for gid, updated in games.items() if known.get(gid) != updated]
+        for gid in changed:
+            con.execute("DELETE FROM clips WHERE game_id = ?", (gid,))
+            con.executemany("INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _rows(gid))
+            con.execute("INSERT OR REPLACE INTO indexed VALUES (?, ?, ?)", (gid, *games[gid]))
+    return len(changed)
+
+# ★ 試合を索引から外す（退避した時。索引がまだ無ければ何もしない）
+def forget(game_id):
+    if not os.path.exists(CLIPS_FILE):
+        return
+    with closing(_connect()) as con, con:
+        con.execute("DELETE FROM clips WHERE game_id = ?", (game_id,))
+        con.execute("DELETE FROM indexed WHERE game_id = ?", (game_id,))
+
+# ★ 条件（列名=値、値はリストなら OR）に合う行を (試合, 動画時刻) 順に返す
+def query(limit=None, **where):
+    conds, args = [], []
+    for k, v in where.items():
+        if k not in FILTERS or v in (None, "", []):
+            continue
+        vals = v if isinstance(v, (list, tuple, set)) else [v]
+        conds.append(f"{k} IN ({', '.join('?' * len(vals))})")
+        args.extend(str(x) for x in vals)
+    sql = ("SELECT game_id, n, set_name, video_url, video_time, phase, player, skill, quality, combo, start_zone, end_zone, score "
+           "FROM clips" + (" WHERE " + " AND ".join(conds) if conds else "") + " ORDER BY game_id, video_time, n")
+    if limit: sql += f" LIMIT {int(limit)}"
+    with closing(_connect()) as con:
+        con.row_factory = sqlite3.Row
+        return [dict(r) for r in con.execute(sql, args)]
+
+# ★ 動画URLに開始秒を付ける（YouTube は t=、それ以外は Media Fragments の #t=）
+def timestamp_url(url, sec):
+    if not url:
+        return ""
+    parts = urlsplit(url)
+    if "youtube.com" in parts.netloc or "youtu.be" in parts.netloc:
+        q = [(k, v) for k, v in parse_qsl(parts.query) if k != "t"] + [("t", f"{sec}s")]
+        return urlunsplit(parts._replace(query=urlencode(q)))
+    return urlunsplit(parts._replace(fragment=f"t={sec}"))
+
+def hms(sec):
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}:{sec % 60:02d}"
+
+def label(c):
+    return f"Set{c['set_name']} {c['score']} {c['skill']}{c['quality']} {c['player']}".strip()
+
+# ★ 出力形式: m3u（URLのプレイリスト）/ chapters（動画ごとのチャプター文字列）/ csv
+def m3u(clips, lead=LEAD_SEC):
+    lines = ["#EXTM3U"]
+    for c in clips:
+        if c["video_url"]:
+            lines += [f"#EXTINF:-1,{c['game_id']} {label(c)}", timestamp_url(c["video_url"], max(0, c["video_time"] - lead))]
+    return "\n".join(lines) + "\n"
+
+def chapters(clips, lead=LEAD_SEC):
+    out, current = [], None
+    for c in sorted(clips, key=lambda c: (c["video_url"], c["video_time"], c["game_id"], c["n"])):
+        if c["video_url"] != current:
+            current = c["video_url"]
+            out += ([""] if out else []) + [f"# {current or '(動画URLなし)'}"]
+        out.append(f"{hms(max(0, c['video_time'] - lead))} {label(c)}")
+    return "\n".join(out) + "\n"
+
+def to_csv(clips, lead=LEAD_SEC):
+    import csv
+    import io
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(["game_id", "set", "score", "player", "skill", "quality", "end_zone", "time", "url"])
+    for c in clips:
+        w.writerow([c["game_id"], c["set_name"], c["score"], c["player"], c["skill"], c["quality"], c["end_zone"],
+                    hms(c["video_time"]), timestamp_url(c["video_url"], max(0, c["video_time"] - lead))])
+    return buf.getvalue()
+
+FORMATS = {"m3u": m3u, "chapters": chapters, "csv": to_csv}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="動画時刻つきのクリップ一覧を作る")
+    ap.add_argument("--game", action="append", dest="game_id")
+    ap.add_argument("--player", action="append")
+    ap.add_argument("--skill", action="append")
+    ap.add_argument("--quality", action="append")
+    ap.add_argument("--zone", action="append", dest="end_zone")
+    ap.add_argument("--set", action="append", dest="set_name")
+    ap.add_argument("--format", choices=FORMATS, default="m3u")
+    ap.add_argument("--lead", type=int, default=LEAD_SEC, help="何秒前から再生するか")
+    ap.add_argument("-o", "--out")
+    args = ap.parse_args()
+    n = refresh()
+    where = {k: getattr(args, k) for k in ("game_id", "player", "skill", "quality", "end_zone", "set_name")}
+    clips = query(**where)
+    text = FORMATS[args.format](clips, args.lead)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    print(f"{len(clips)} clips（索引を更新した試合 {n}）", file=sys.stderr)
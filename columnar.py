@@ -0,0 +1,106 @@
+import functools
+import glob
+import importlib.util
+import os
+import sys
+
+# ★ pandas / pyarrow は実際に読み書きする時に初めて import する（起動時・CSV保存時は不要）
+#   pyarrow が無ければCSVのみ
+def _pa():
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    return pa, feather
+
+# ★ 記録行(final_row)の列型付きバイナリ形式（Arrow IPC / Feather v2、無圧縮で memory-map 読み）
+#   座標は数値(NaN=未入力)、スコアは my/op の整数2列、スキル・評価・ゾーン等はカテゴリ列にする
+NUMERIC = ['start_x', 'start_y', 'end_x', 'end_y']
+CATEGORICAL = ['set', 'phase', 'setter', 'player', 'skill', 'combo', 'quality',
+               'start_zone', 'end_zone', 'video_url', 'att_phase'] + [f"pos{i}" for i in range(1, 7)]
+SPLIT = {'score': ['score_my', 'score_op']}
+
+@functools.lru_cache(maxsize=1)
+def available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+def arrow_file(game_id):
+    return f"autosave_data_{game_id}.arrow"
+
+def _str_col(s):
+    return s.where(s.notna(), "").astype(str)
+
+def encode(df):
+    import pandas as pd
+    out = {}
+    for c in df.columns:
+        if c == 'score':
+            parts = _str_col(df[c]).str.split('-', n=1, expand=True).reindex(columns=[0, 1])
+            out['score_my'] = pd.to_numeric(parts[0], errors='coerce').fillna(0).astype('int16')
+            out['score_op'] = pd.to_numeric(parts[1], errors='coerce').fillna(0).astype('int16')
+        elif c in NUMERIC:
+            out[c] = pd.to_numeric(df[c], errors='coerce').astype('float64')
+        elif c == 'video_time':
+            out[c] = pd.to_numeric(df[c], errors='coerce').fillna(0).astype('int32')
+        elif c in CATEGORICAL:
+            out[c] = _str_col(df[c]).astype('category')
+        else:
+            out[c] = _str_col(df[c])
+    return pd.DataFrame(out, index=range(len(df)))
+
+# ★ encode の逆。final_row と同じ列（スコアは "12-10" 形式）に戻す
+def decode(df):
+    import pandas as pd
+    out = {}
+    for c in df.columns:
+        if c == 'score_op':
+            continue
+        if c == 'score_my':
+            out['score'] = df['score_my'].astype(str) + "-" + df['score_op'].astype(str)
+        elif isinstance(df[c].dtype, pd.CategoricalDtype):
+            out[c] = df[c].astype(object)
+        else:
+            out[c] = df[c]
+    return pd.DataFrame(out, index=range(len(df)))
+
+def _physical_columns(columns):
+    if columns is None:
+        return None
+    cols = []
+    for c in columns:
+        cols.extend(SPLIT.get(c, [c]))
+    return cols
+
+# ★ dest はパスかバイナリのファイルオブジェクト
+def write(dest, df):
+    pa, feather = _pa()
+    table = pa.Table.from_pandas(encode(df), preserve_index=False)
+    feather.write_feather(table, dest, compression='uncompressed')
+
+# ★ 必要な列だけを memory-map で読む（列を絞れば他の列はディスクから読まれない）
+def read(path, columns=None, decoded=True):
+    pa, feather = _pa()
+    cols = _physical_columns(columns)
+    if cols is not None:
+        names = pa.ipc.open_file(pa.memory_map(path)).schema.names
+        cols = [c for c in cols if c in names]
+    df = feather.read_table(path, columns=cols, memory_map=True).to_pandas()
+    return decode(df) if decoded else df
+
+# ★ 既存の autosave_data_*.csv を .arrow に変換する（python columnar.py [ID ...]）
+def convert(game_id):
+    import storage
+    with storage.game_lock(game_id):
+        csv_path = storage.data_file(game_id)
+        if not os.path.exists(csv_path):
+            return False
+        import pandas as pd
+        df = pd.read_csv(csv_path)
+        storage.atomic_write(arrow_file(game_id), lambda f: write(f, df), binary=True)
+        os.remove(csv_path)
+    return True
+
+if __name__ == "__main__":
+    if not available():
+        sys.exit("pyarrow がインストールされていません")
+    ids = sys.argv[1:] or [os.path.basename(p)[len("autosave_data_"):-len(".csv")] for p in glob.glob("autosave_data_*.csv")]
+    for gid in ids:
+        print(f"{gid}: {'converted' if convert(gid) else 'skipped'}")
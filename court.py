@@ -0,0 +1,135 @@
+import functools
+import io
+import math
+from PIL import Image, ImageDraw, ImageFont
+import profiler
+
+# ★ コート画像の座標系。表示サイズ(450x720)と同じピクセル数で一度だけラスタライズする
+X_MIN, X_MAX, Y_MIN, Y_MAX = -3, 12, -3, 21
+WIDTH, HEIGHT = 450, 720
+MARKER_R = 10
+
+def to_px(lx, ly):
+    return ((lx - X_MIN) / (X_MAX - X_MIN) * WIDTH, (Y_MAX - ly) / (Y_MAX - Y_MIN) * HEIGHT)
+
+# ★ コート・ゾーン線・アタックラインなど静的な部分。プロセスで1回だけ描く
+@functools.lru_cache(maxsize=1)
+@profiler.timed("court_background")
+def court_background():
+    from matplotlib.figure import Figure
+    import matplotlib.patches as patches
+    fig = Figure(figsize=(WIDTH / 120, HEIGHT / 120), dpi=120)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.add_patch(patches.Rectangle((-3, -3), 15, 24, fc='#e0e0e0', ec='none'))
+    ax.add_patch(patches.Rectangle((0, 0), 9, 18, fc='#FFCC99', ec='black', lw=2))
+    ax.plot([3,3], [0,18], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
+    ax.plot([6,6], [0,18], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
+    ax.plot([0,9], [3,3], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
+    ax.plot([0,9], [15,15], c='gray', ls=':', lw=1.5, alpha=0.5, zorder=1)
+    ax.plot([0,9], [9,9], c='red', lw=3, zorder=2)
+    ax.plot([0,9], [6,6], c='black', lw=2, zorder=2)
+    ax.plot([0,9], [12,12], c='black', lw=2, zorder=2)
+    ax.plot([-3,-3,12,12,-3], [-3,21,21,-3,-3], c='black', lw=2)
+    ax.set_xlim(X_MIN, X_MAX); ax.set_ylim(Y_MIN, Y_MAX); ax.axis('off')
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    buf.seek(0)
+    return Image.open(buf).convert('RGBA')
+
+@functools.lru_cache(maxsize=1)
+def _label_font():
+    return ImageFont.load_default(size=12)
+
+# ★ 始点→終点の矢印（マーカーの下になるように先に描く）
+def _draw_arrow(draw, start, end):
+    (sx, sy), (ex, ey) = start, end
+    ang = math.atan2(ey - sy, ex - sx)
+    dist = math.hypot(ex - sx, ey - sy)
+    if dist < 1: return
+    # 矢じりの先端は終点マーカーの縁で止める
+    tip = (ex - math.cos(ang) * min(MARKER_R, dist), ey - math.sin(ang) * min(MARKER_R, dist))
+    base = (tip[0] - math.cos(ang) * 12, tip[1] - math.sin(ang) * 12)
+    col = (128, 128, 128, 153)
+    draw.line([(sx, sy), base], fill=col, width=3)
+    nx, ny = -math.sin(ang) * 5, math.cos(ang) * 5
+    draw.polygon([tip, (base[0] + nx, base[1] + ny), (base[0] - nx, base[1] - ny)], fill=col)
+
+# ★ 背景のコピーにS/Eマーカーと矢印だけ重ねる。points の座標タプルごとにメモ化
+@functools.lru_cache(maxsize=64)
+@profiler.timed("court_render")
+def _court_with_markers(coords):
+    overlay = Image.new('RGBA', (WIDTH, HEIGHT), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    px = [to_px(lx, ly) for lx, ly in coords]
+    if len(px) >= 2:
+        _draw_arrow(draw, px[0], px[1])
+    for i, (x, y) in enumerate(px):
+        col = (0, 0, 255, 255) if i == 0 else (255, 0, 0, 255)
+        draw.ellipse([x - MARKER_R, y - MARKER_R, x + MARKER_R, y + MARKER_R], fill=col, outline='white', width=1)
+        draw.text((x, y), "S" if i == 0 else "E", fill='white', font=_label_font(), anchor='mm')
+    return Image.alpha_composite(court_background(), overlay).convert('RGB')
+
+def create_court_img(points):
+    return _court_with_markers(tuple((p[2], p[3]) for p in points[:2]))
+
+# ★ 多数のラリーをまとめて描く（背景はキャッシュ済みの court_background() を敷くだけ）
+def _figure():
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(WIDTH / 120, HEIGHT / 120), dpi=120)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.imshow(court_background(), extent=(X_MIN, X_MAX, Y_MIN, Y_MAX), zorder=0)
+    ax.set_xlim(X_MIN, X_MAX); ax.set_ylim(Y_MIN, Y_MAX); ax.axis('off')
+    return fig, ax
+
+def _to_image(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    buf.seek(0)
+    return Image.open(buf)
+
+# ★ 始点→終点の矢印を quiver 1回（1つのコレクション）で描く。終点だけの行は点で描く
+@profiler.timed("court_chart")
+def spray_chart(sx, sy, ex, ey, color='#1f77b4'):
+    import numpy as np
+    sx, sy, ex, ey = (np.asarray(v, dtype=float) for v in (sx, sy, ex, ey))
+    fig, ax = _figure()
+    both = ~(np.isnan(sx) | np.isnan(sy) | np.isnan(ex) | np.isnan(ey))
+    if both.any():
+        ax.quiver(sx[both], sy[both], ex[both] - sx[both], ey[both] - sy[both], angles='xy', scale_units='xy', scale=1,
+                  color=color, alpha=0.5, width=0.004, headwidth=4, headlength=5, zorder=5)
+    only_s = ~both & ~(np.isnan(sx) | np.isnan(sy))
+    if only_s.any():
+        ax.scatter(sx[only_s], sy[only_s], s=12, c=color, alpha=0.6, zorder=6)
+    return _to_image(fig)
+
+# ★ コート(9x18)を1m四方に分けた密度をヒートマップで重ねる（np.histogram2d + imshow 1枚）
+@profiler.timed("court_chart")
+def heatmap(x, y, bins=(9, 18), cmap='Reds'):
+    import numpy as np
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    h, _, _ = np.histogram2d(x[ok], y[ok], bins=bins, range=[[0, 9], [0, 18]])
+    fig, ax = _figure()
+    if h.max() > 0:
+        ax.imshow(np.ma.masked_equal(h.T, 0), extent=(0, 9, 0, 18), origin='lower', cmap=cmap, alpha=0.7,
+                  interpolation='nearest', zorder=3)
+    return _to_image(fig)
+
+# ★ 保存済み全試合から絞り込んで描く（python court.py out.png --skill A --player 名前 [--pos1 名前] [--heat]）
+if __name__ == "__main__":
+    import argparse
+    import analytics
+    ap = argparse.ArgumentParser()
+    ap.add_argument("out")
+    ap.add_argument("--skill", default="A")
+    ap.add_argument("--player")
+    ap.add_argument("--pos1")
+    ap.add_argument("--heat", action="store_true", help="終点の密度ヒートマップを描く")
+    args = ap.parse_args()
+    df = analytics.load_frames(columns=['player', 'skill', 'pos1'] + analytics.COORDS)
+    df = df[df['skill'] == args.skill]
+    if args.player: df = df[df['player'] == args.player]
+    if args.pos1: df = df[df['pos1'] == args.pos1]
+    img = heatmap(df['end_x'], df['end_y']) if args.heat else spray_chart(df['start_x'], df['start_y'], df['end_x'], df['end_y'])
+    img.save(args.out)
+    print(f"{len(df)} rows -> {args.out}")
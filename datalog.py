@@ -0,0 +1,72 @@
+import sys
+import profiler
+
+# ★ 列ごとのリストで持つデータログ（旧: 行dictのリスト）
+#   append/pop は O(1)、DataFrame は行が変わった時（version が進んだ時）だけ作り直す
+#   文字列は intern して持つ（選手名・コンビ・動画URL等は行ごとに同じ値。JSON/CSV から読んだ行も1つの文字列を共有する）
+#   intern はメモリ上だけの話で、保存（CSVスナップショット・ジャーナル）は名前をそのまま書く（番号にはしない。保存サイズは変わらない）
+def _intern(v):
+    return sys.intern(v) if type(v) is str else v
+
+class DataLog:
+    def __init__(self, rows=()):
+        self.columns = {}  # 列名 → 値のリスト（列順は最初に現れた順）
+        self.length = 0
+        self.version = 0
+        self._frame = None
+        self._frame_version = -1
+        self._reversed = None
+        self._reversed_version = -1
+        for row in rows:
+            self.append(row)
+
+    @classmethod
+    def from_frame(cls, df):
+        log = cls()
+        log.columns = {c: [_intern(v) for v in df[c].tolist()] if df[c].dtype == object else df[c].tolist()
+                       for c in df.columns}
+        log.length = len(df)
+        return log
+
+    def __len__(self):
+        return self.length
+
+    def append(self, row):
+        for k in row:
+            if k not in self.columns:
+                self.columns[k] = [""] * self.length  # 途中から増えた列は過去行を空で埋める
+        for k, col in self.columns.items():
+            col.append(_intern(row.get(k, "")))
+        self.length += 1
+        self.version += 1
+
+    def pop(self):
+        row = {k: col.pop() for k, col in self.columns.items()}
+        self.length -= 1
+        self.version += 1
+        return row
+
+    # ★ 列リストの浅い写し（値の文字列・数値は共有。背景スレッドに渡す時に使う）
+    def copy(self):
+        log = DataLog()
+        log.columns = {k: list(col) for k, col in self.columns.items()}
+        log.length = self.length
+        return log
+
+    def row(self, i):
+        return {k: col[i] for k, col in self.columns.items()}
+
+    def frame(self):
+        if self._frame_version != self.version:
+            import pandas as pd
+            with profiler.span("dataframe_build"):
+                self._frame = pd.DataFrame(self.columns)
+            self._frame_version = self.version
+        return self._frame
+
+    # ★ 表示用（新しい行が上）
+    def reversed_frame(self):
+        if self._reversed_version != self.version:
+            self._reversed = self.frame().iloc[::-1]
+            self._reversed_version = self.version
+        return self._reversed
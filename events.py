@@ -0,0 +1,199 @@
+import copy
+import os
+import lineup
+import ranking
+
+FIXED_COMBOS_TOP = ['V5', 'X5', 'VC', 'XC']
+FIXED_COMBOS_MID = ['Q1', 'Q3', 'B1', 'BC']
+ALL_FIXED_COMBOS = FIXED_COMBOS_TOP + FIXED_COMBOS_MID
+
+# ★ イベント列から導出する状態（セッションには結果を置くだけで、直接書き換えない）
+DERIVED = ('score', 'lineup', 'phase', 'setter_counts', 'player_counts', 'custom_combo_pool', 'stats')
+# ★ セッションには置かない状態: ranks = 種類 → 使用回数順の並び（ranking）。init の回数から作り直す
+STATE = DERIVED + ('ranks',)
+RANKED = {'player': 'player_counts', 'setter': 'setter_counts', 'combo': 'custom_combo_pool'}
+
+# ★ ライブ集計のカウンタ: so/bp = [得点, ラリー数]（R局面=サイドアウト / S局面=ブレイク）、att = 選手 → [本数, 決定, 失点]
+def empty_stats():
+    return {'so': [0, 0], 'bp': [0, 0], 'att': {}}
+
+# ★ 古い保存の初期状態に無い項目（init から作る）。lineup は旧形式の rotation（6人のリスト）から
+OPTIONAL = {'stats': lambda init: empty_stats(), 'lineup': lambda init: lineup.new(init.get('rotation') or []),
+            'ranks': lambda init: {k: ranking.new(init.get(c)) for k, c in RANKED.items()}}
+
+# ★ 読み込みのたびにイベント列を init から全再生して状態と照合するか（SCOUT_VERIFY=1。既定は保存した状態との突き合わせだけ）
+VERIFY_ON_LOAD = os.environ.get("SCOUT_VERIFY", "") not in ("", "0")
+
+# ★ この件数ごとに状態のチェックポイントを取る。巻き戻しは直前のチェックポイントからの再生で済む
+CHECKPOINT_EVERY = 50
+
+# ★ 記録行の評価から得点側を決める: 自チームの決定（A/B/S の #、A の T）は 'my'、^ は 'op'、それ以外は None
+def point_winner(skill, quality):
+    if (skill in ('A', 'B', 'S') and quality == '#') or (skill == 'A' and quality == 'T'): return 'my'
+    if quality == '^': return 'op'
+    return None
+
+def _point(state, winner):
+    if winner:
+        rally = state['stats']['so' if state['phase'] == 'R' else 'bp']
+        rally[1] += 1
+        if winner == 'my': rally[0] += 1
+    if winner == 'my': state['score'][0] += 1
+    elif winner == 'op': state['score'][1] += 1
+    _turn(state, winner)
+
+# ★ 得点による局面とローテの変化（position_columns はこれとラインナップの変化だけを再生する）
+def _turn(state, winner):
+    if winner == 'my':
+        if state['phase'] == 'R':
+            _rotate(state)
+        state['phase'] = 'S'
+    elif winner == 'op':
+        state['phase'] = 'R'
+
+def _rotate(state):
+    lineup.rotate(state['lineup'])
+
+def _bump(state, kind, key):
+    counts = state[RANKED[kind]]
+    c = counts.get(key, 0)
+    counts[key] = c + 1
+    ranking.bump(state['ranks'][kind], key, c)
+
+# ★ イベント1件を状態に畳み込む（state をその場で更新）
+#   {'k': 'row', 'w': 'my'/'op'/None, 'setter', 'player', 'skill', 'combo', 'q'} 記録1行（得点を伴う場合は w）
+#   {'k': 'point', 'w': 'my'/'op'} My/Op Point ボタン / {'k': 'rotate'} ローテ手動補正
+#   {'k': 'sub', 'out', 'in', 'libero': bool} 選手交代（libero はリベロの入れ替え）
+def apply_event(state, ev):
+    k = ev['k']
+    if k == 'row':
+        if ev.get('setter') and ev['setter'] not in ("ダイレクト", "ツー"):
+            _bump(state, 'setter', ev['setter'])
+        if ev.get('skill') != 'S' and ev.get('player'):
+            _bump(state, 'player', ev['player'])
+        if ev.get('skill') == 'A' and ev.get('combo') and ev['combo'] not in ALL_FIXED_COMBOS:
+            _bump(state, 'combo', ev['combo'])
+        if ev.get('skill') == 'A' and ev.get('player'):
+            att = state['stats']['att'].setdefault(ev['player'], [0, 0, 0])
+            att[0] += 1
+            if ev.get('q') in ('#', 'T'): att[1] += 1
+            elif ev.get('q') == '^': att[2] += 1
+        _point(state, ev.get('w'))
+    elif k == 'point':
+        _point(state, ev['w'])
+    elif k == 'rotate':
+        _rotate(state)
+    elif k == 'sub':
+        lineup.sub(state['lineup'], ev['out'], ev['in'], ev.get('libero', False))
+
+def fold(init, events):
+    state = copy.deepcopy(init)
+    for ev in events:
+        apply_event(state, ev)
+    return state
+
+# ★ 試合のイベント列。スコア・ローテ・各カウンタは init からの畳み込みで決まる
+#   Undo はイベントを redo 側へ移して直前のチェックポイントから再計算、Redo は戻して適用し直す
+#   redo の各要素は [event, payload]（payload は呼び出し側が退避したい物。例: Undoで外した記録行）
+class EventLog:
+    def __init__(self, init):
+        self.init = {k: copy.deepcopy(init[k]) if init.get(k) is not None else OPTIONAL[k](init) for k in STATE}
+        self.events = []
+        self.redo_stack = []
+        self.checkpoints = [copy.deepcopy(self.init)]  # checkpoints[j] = j*CHECKPOINT_EVERY 件目までの状態
+        self.state = copy.deepcopy(self.init)
+
+    @classmethod
+    def from_dict(cls, d):
+        log = cls(d["init"])
+        log.events, log.redo_stack = d["events"], d["redo"]
+        checkpoints = d.get("checkpoints") or []
+        if len(checkpoints) == len(log.events) // CHECKPOINT_EVERY + 1 and all(set(STATE) <= set(c) for c in checkpoints):
+            log.checkpoints = checkpoints
+            log.state = log.state_at(len(log.events))
+        else:
+            log.rebuild()
+        return log
+
+    # ★ init から全イベントを畳み込み直してチェックポイントを作り直す
+    def rebuild(self):
+        events, self.events = self.events, []
+        self.checkpoints = [copy.deepcopy(self.init)]
+        self.state = copy.deepcopy(self.init)
+        for ev in events:
+            self._append(ev)
+
+    def to_dict(self):
+        return {"init": self.init, "events": self.events, "redo": self.redo_stack, "checkpoints": self.checkpoints}
+
+    # ★ 背景スレッドに渡す写し。イベント・チェックポイントは積んだ後に書き換えないので、リストだけ複製する
+    def snapshot(self):
+        log = EventLog.__new__(EventLog)
+        log.init, log.events, log.redo_stack = self.init, list(self.events), list(self.redo_stack)
+        log.checkpoints, log.state = list(self.checkpoints), copy.deepcopy(self.state)
+        return log
+
+    def _append(self, ev):
+        self.events.append(ev)
+        apply_event(self.state, ev)
+        n = len(self.events)
+        if n % CHECKPOINT_EVERY == 0 and len(self.checkpoints) == n // CHECKPOINT_EVERY:
+            self.checkpoints.append(copy.deepcopy(self.state))
+
+    def push(self, ev):
+        self._append(ev)
+        self.redo_stack.clear()
+
+    def undo(self, payload=None):
+        ev = self.events.pop()
+        self.redo_stack.append([ev, payload])
+        del self.checkpoints[len(self.events) // CHECKPOINT_EVERY + 1:]
+        self.state = self.state_at(len(self.events))
+        return ev
+
+    def redo(self):
+        ev, payload = self.redo_stack.pop()
+        self._append(ev)
+        return ev, payload
+
+    # ★ n件目までを適用した状態。直前のチェックポイントから再生するので O(CHECKPOINT_EVERY)
+    def state_at(self, n):
+        j = min(n // CHECKPOINT_EVERY, len(self.checkpoints) - 1)
+        state = copy.deepcopy(self.checkpoints[j])
+        for ev in self.events[j * CHECKPOINT_EVERY:n]:
+            apply_event(state, ev)
+        return state
+
+    # ★ 整合性チェック: 現在の状態が init からの全再生と一致するか（全件を畳み込むので読み込みのたびには呼ばない）
+    def verify(self):
+        return fold(self.init, self.events) == self.state
+
+# ★ 各記録行の時点の pos1〜pos6（列ごと）。保存から外したポジション列を読み込み時に作り直す
+#   'row' イベントの数と記録行の数が同じ時だけ使える（旧形式の 'row' op で足した行があると合わない）
+#   ポジションに効くのは局面とラインナップだけなので、カウンタ・集計は畳み込まない
+def position_columns(elog):
+    state = {'phase': elog.init['phase'], 'lineup': copy.deepcopy(elog.init['lineup'])}
+    cols = {c: [] for c in lineup.POS_COLUMNS}
+    for ev in elog.events:
+        k = ev['k']
+        if k == 'row':
+            for c, name in lineup.positions(state['lineup']).items():
+                cols[c].append(name)
+        if k in ('row', 'point'): _turn(state, ev.get('w'))
+        elif k == 'rotate': _rotate(state)
+        elif k == 'sub': lineup.sub(state['lineup'], ev['out'], ev['in'], ev.get('libero', False))
+    return cols
+
+def row_count(elog):
+    return sum(1 for ev in elog.events if ev['k'] == 'row')
+
+# ★ 記録行を伴うイベント（'row'）は DataLog 側も一緒に戻す/進める
+def undo_event(elog, rows):
+    payload = rows.pop() if elog.events[-1]['k'] == 'row' else None
+    return elog.undo(payload)
+
+def redo_event(elog, rows):
+    ev, row = elog.redo()
+    if row is not None:
+        rows.append(row)
+    return ev
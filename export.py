@@ -0,0 +1,82 @@
+import csv
+import io
+import math
+import background
+import profiler
+
+# ★ エクスポート時の列名の付け替え
+EXPORT_RENAME = {"video_url": "Video_URL", "video_time": "Time_Sec"}
+
+# ★ 記録行(final_row)の列（commit_record と同じ順）。pos1〜6・att_phase は後から増えた列なので古い書き出しには無い
+ROW_COLUMNS = ["set", "score", "phase", "setter", "player", "skill", "combo", "quality",
+               "start_zone", "end_zone", "start_x", "start_y", "end_x", "end_y", "memo", "video_url", "video_time",
+               "pos1", "pos2", "pos3", "pos4", "pos5", "pos6", "att_phase"]
+LATER_COLUMNS = ["pos1", "pos2", "pos3", "pos4", "pos5", "pos6", "att_phase"]
+
+MIME = {".xlsx": "application/vnd.ms-excel", ".csv": "text/csv"}
+# ★ 入力がこの秒数止まっていたら、選択中の形式を背景で先に作っておく
+PREBUILD_IDLE_SEC = 3.0
+
+def export_header(log):
+    return [EXPORT_RENAME.get(c, c) for c in log.columns]
+
+# ★ DataLog の列リストから1行ずつ取り出す（DataFrameのコピーを作らない）。CSV由来のNaNは空欄に
+def iter_export_rows(log):
+    for row in zip(*log.columns.values()):
+        yield ["" if isinstance(v, float) and math.isnan(v) else v for v in row]
+
+def build_csv(log):
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(export_header(log))
+    w.writerows(iter_export_rows(log))
+    return buf.getvalue().encode('utf-8-sig')
+
+# ★ XlsxWriter はここで初めて読み込む。constant_memory で1行ずつ書き出す
+def build_xlsx(log):
+    import xlsxwriter
+    buf = io.BytesIO()
+    wb = xlsxwriter.Workbook(buf, {'in_memory': True, 'constant_memory': True})
+    ws = wb.add_worksheet()
+    bold = wb.add_format({'bold': True})
+    ws.write_row(0, 0, export_header(log), bold)
+    for i, row in enumerate(iter_export_rows(log), start=1):
+        ws.write_row(i, 0, row)
+    wb.close()
+    return buf.getvalue()
+
+BUILDERS = {".xlsx": build_xlsx, ".csv": build_csv}
+
+def _key(log, game_id, sets):
+    return (game_id, len(sets), log.version, len(log))
+
+# ★ sets（凍結セットの目録）があれば、凍結ファイルを読んで進行中のセットの前につなげる
+def _build(log, fmt, sets):
+    if sets:
+        import storage
+        log = storage.match_log(sets, log)
+    return BUILDERS[fmt](log)
+
+# ★ (game_id, 凍結セット数, ログのversion, 形式) ごとに1回だけ作る。cache は形式 → (キー, バイト列)
+def export_bytes(log, game_id, fmt, cache, sets=()):
+    key = _key(log, game_id, sets)
+    hit = cache.get(fmt)
+    if hit is None or hit[0] != key:
+        with profiler.span(f"export_build{fmt}"):
+            hit = cache[fmt] = (key, _build(log, fmt, sets))
+    return hit[1]
+
+# ★ 先回り生成: キャッシュが古ければ、ログの写しを背景に渡しておく（入力が止まったままなら作って cache に入れる）
+#   このセッションで一度もダウンロードしていない形式は作らない（誰も使わない Excel を記録中に組み立てない）
+#   同じIDの生成が待機中・実行中なら何もしない。間に合わなければ export_bytes がその場で作る
+def prebuild(log, game_id, fmt, cache, sets=()):
+    key = _key(log, game_id, sets)
+    hit = cache.get(fmt)
+    lane = f"export:{game_id}"
+    if hit is None or hit[0] == key or not background.idle(lane):
+        return
+    snap, sets = log.copy(), list(sets)
+
+    def build():
+        cache[fmt] = (key, _build(snap, fmt, sets))
+    background.submit_idle(lane, PREBUILD_IDLE_SEC, lambda: _key(log, game_id, sets) == key, build)
@@ -0,0 +1,89 @@
+import contextlib
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+# ★ 保存済み試合の一覧（IDゲート用）。保存のたびに1行だけ更新するので、一覧表示でファイルを開かずに済む
+#   接続はプロセスで1本を使い回す（表・索引の作成は開いた時の1回だけ）。背景の保存スレッドからも使うのでロックで順に
+#   upsert はセット・スコアが前回と同じなら、行数だけの変化は ROWS_INTERVAL_SEC 秒に1回しか書かない
+#   （1タップごとに索引のトランザクションを足さない。一覧の行数は最大でその秒数だけ遅れる）
+INDEX_FILE = "autosave_index.sqlite"
+PAGE_SIZE = 30
+ROWS_INTERVAL_SEC = 5.0
+
+_con = None
+_con_path = None
+_lock = threading.RLock()
+_last = {}  # game_id → 最後に書いた ((set_name, score), rows, 時刻)
+
+@contextlib.contextmanager
+def _connect():
+    global _con, _con_path
+    path = os.path.abspath(INDEX_FILE)
+    with _lock:
+        if _con is None or _con_path != path or not os.path.exists(path):
+            if _con is not None: _con.close()
+            _con = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            _con.execute("PRAGMA journal_mode=WAL")
+            _con.execute("PRAGMA synchronous=NORMAL")
+            _con.execute("PRAGMA wal_autocheckpoint=100")       # 接続を開いたままなので WAL を小さいうちに書き戻す
+            _con.execute("PRAGMA journal_size_limit=1048576")
+            _con.execute("""CREATE TABLE IF NOT EXISTS games (
+                game_id TEXT PRIMARY KEY, set_name TEXT, score TEXT, rows INTEGER, updated REAL)""")
+            _con.execute("CREATE INDEX IF NOT EXISTS games_updated ON games(updated)")
+            _con.commit()
+            _con_path = path
+            _last.clear()
+        with _con:
+            yield _con
+
+def upsert(game_id, set_name, score, rows, updated=None):
+    ensure_index()
+    head, now = (str(set_name), f"{score[0]}-{score[1]}"), time.monotonic()
+    with _connect() as con:
+        last = _last.get(game_id)
+        if updated is None and last and last[0] == head and (last[1] == rows or now - last[2] < ROWS_INTERVAL_SEC):
+            return
+        con.execute("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?)", (game_id, *head, rows, updated or time.time()))
+        _last[game_id] = (head, rows, now)
+
+def remove(game_id):
+    with _connect() as con:
+        con.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+        _last.pop(game_id, None)
+
+# ★ query はIDの部分一致。新しい順に (game_id, set_name, score, rows, updated) を返す
+def list_games(query="", page=0, page_size=PAGE_SIZE):
+    with _connect() as con:
+        return con.execute("""SELECT game_id, set_name, score, rows, updated FROM games
+            WHERE game_id LIKE ? ORDER BY updated DESC LIMIT ? OFFSET ?""",
+            (f"%{query}%", page_size, page * page_size)).fetchall()
+
+def count_games(query=""):
+    with _connect() as con:
+        return con.execute("SELECT COUNT(*) FROM games WHERE game_id LIKE ?", (f"%{query}%",)).fetchone()[0]
+
+def lookup(game_id):
+    with _connect() as con:
+        return con.execute("SELECT game_id, set_name, score, rows, updated FROM games WHERE game_id = ?",
+                           (game_id,)).fetchone()
+
+# ★ 既存の保存ファイルから索引を作り直す（索引が無い時の初回のみ。以降は保存時の upsert で追従）
+def rebuild():
+    import storage
+    with _connect() as con:
+        con.execute("DELETE FROM games")
+        _last.clear()
+    for sf in glob.glob("autosave_state_*.json"):
+        gid = os.path.basename(sf)[len("autosave_state_"):-len(".json")]
+        loaded = storage.Journal(gid).load(claim=False)
+        if loaded is None:
+            continue
+        rows, state, _ = loaded
+        upsert(gid, state.get("set_name", ""), state.get("score", [0, 0]), len(rows), os.path.getmtime(sf))
+
+def ensure_index():
+    if not os.path.exists(INDEX_FILE):
+        rebuild()
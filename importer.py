@@ -0,0 +1,229 @@
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import archive
+import events
+import export
+import game_index
+import lineup
+import storage
+from datalog import DataLog
+
+# ★ データログの書き出し（scout_set*.xlsx / .csv）を保存データに取り込む
+#   python importer.py ファイルまたはフォルダ ... [--start-id 90000] [--workers N] [--skip-invalid] [--dry-run]
+#   xlsx は read-only で1行ずつ読む。1ファイル＝1試合（1つのID）で、最後のセット以外は終了済みセットとして凍結する
+#   スコア・ローテ・各カウンタはセットごとにイベント列を再生して作る
+START_ID = 90000
+IMPORT_RENAME = {v: k for k, v in export.EXPORT_RENAME.items()}
+SKILLS = {"S", "R", "A", "B", "D", "E"}
+QUALITIES = {"#", "!", "-", "T", '"', "/", "^"}
+SCORE_RE = re.compile(r"^(\d+)-(\d+)$")
+COORDS = ("start_x", "start_y", "end_x", "end_y")
+
+class InvalidExport(ValueError):
+    pass
+
+def _cell(v):
+    if v is None: return ""
+    if isinstance(v, str): return v.strip()
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    return v
+
+# ★ 1行ずつ返す（先頭はヘッダ）。ブック全体をメモリに載せない
+def iter_rows(path):
+    if path.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            for row in wb.worksheets[0].iter_rows(values_only=True):
+                yield [_cell(v) for v in row]
+        finally:
+            wb.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.reader(f):
+                yield [_cell(v) for v in row]
+
+def _header(raw):
+    cols = [IMPORT_RENAME.get(str(c), str(c)) for c in raw]
+    while cols and cols[-1] == "": cols.pop()
+    missing = [c for c in export.ROW_COLUMNS if c not in cols and c not in export.LATER_COLUMNS]
+    if missing:
+        raise InvalidExport(f"列がありません: {', '.join(export.EXPORT_RENAME.get(c, c) for c in missing)}")
+    return cols
+
+def _num(v):
+    if v == "": return ""
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        raise InvalidExport(f"数値ではありません: {v!r}")
+
+# ★ final_row と同じ型にそろえて検査する（座標は float か ""、Time_Sec は int、他は文字列）
+def parse_row(cols, raw):
+    row = {c: raw[i] if i < len(raw) else "" for i, c in enumerate(cols)}
+    for c in export.LATER_COLUMNS:
+        row.setdefault(c, "")
+    for c in row:
+        if c not in COORDS and c != "video_time":
+            row[c] = "" if row[c] == "" else str(row[c])
+    for c in COORDS:
+        row[c] = _num(row[c])
+    vt = _num(row["video_time"])
+    row["video_time"] = 0 if vt == "" else int(vt)
+    if not SCORE_RE.match(row["score"]):
+        raise InvalidExport(f"score が不正です: {row['score']!r}")
+    if row["phase"] not in ("R", "S"):
+        raise InvalidExport(f"phase が不正です: {row['phase']!r}")
+    if row["skill"] not in SKILLS:
+        raise InvalidExport(f"skill が不正です: {row['skill']!r}")
+    if row["quality"] not in QUALITIES:
+        raise InvalidExport(f"quality が不正です: {row['quality']!r}")
+    if row["att_phase"] not in ("", "R", "T", "C"):
+        raise InvalidExport(f"att_phase が不正です: {row['att_phase']!r}")
+    return row
+
+# ★ ファイルを読んでセットごとの行リストにする。errors は (行番号, 内容)
+def read_sets(path, skip_invalid=False):
+    it = iter_rows(path)
+    cols = _header(next(it, []))
+    sets, errors = {}, []
+    for n, raw in enumerate(it, start=2):
+        if not any(v != "" for v in raw):
+            continue
+        try:
+            row = parse_row(cols, raw)
+        except InvalidExport as e:
+            errors.append((n, str(e)))
+            continue
+        sets.setdefault(row["set"], []).append(row)
+    if errors and not skip_invalid:
+        raise InvalidExport("; ".join(f"{n}行目: {msg}" for n, msg in errors[:5]) + (" ..." if len(errors) > 5 else ""))
+    return sets, errors
+
+def _positions(row):
+    p = [row[f"pos{i}"] for i in range(1, 7)]
+    # get_positions の逆: r[0]=P1, r[5]=P2, r[4]=P3, r[3]=P4, r[2]=P5, r[1]=P6
+    return [p[0], p[5], p[4], p[3], p[2], p[1]] if all(p) else None
+
+def _score(row):
+    m = SCORE_RE.match(row["score"])
+    return [int(m.group(1)), int(m.group(2))]
+
+# ★ 記録行から イベント列・状態 を作り直す
+#   書き出しには My/Op Point・ローテ補正・交代が残らないので、次の行のスコアとポジションに合うように point/rotate/sub を補う
+def replay(rows):
+    first = rows[0]
+    init = {"score": _score(first), "rotation": _positions(first) or [""] * 6, "phase": first["phase"],
+            "setter_counts": {}, "player_counts": {}, "custom_combo_pool": {}}
+    elog = events.EventLog(init)
+    log = DataLog()
+    mismatch = 0
+    for row in rows:
+        state = elog.state
+        want = _score(row)
+        my, op = want[0] - state["score"][0], want[1] - state["score"][1]
+        if my < 0 or op < 0:
+            mismatch += 1
+        else:
+            for _ in range(op): elog.push({"k": "point", "w": "op"})
+            for _ in range(my): elog.push({"k": "point", "w": "my"})
+        target = _positions(row)
+        if target and lineup.order(elog.state["lineup"]) != target:
+            cur = lineup.order(elog.state["lineup"])
+            k = min(range(6), key=lambda k: sum(a != b for a, b in zip(cur[-k:] + cur[:-k] if k else cur, target)))
+            for _ in range(k): elog.push({"k": "rotate"})
+            for out, new in zip(lineup.order(elog.state["lineup"]), target):
+                if out != new: elog.push({"k": "sub", "out": out, "in": new})
+            if lineup.order(elog.state["lineup"]) != target: mismatch += 1
+        if elog.state["phase"] != row["phase"]:
+            mismatch += 1
+        log.append(row)
+        elog.push({"k": "row", "w": events.point_winner(row["skill"], row["quality"]), "setter": row["setter"],
+                   "player": row["player"], "skill": row["skill"], "combo": row["combo"], "q": row["quality"]})
+    players = []
+    for row in rows:
+        for name in [row[f"pos{i}"] for i in range(1, 7)] + [row["player"], row["setter"]]:
+            if name and name not in ("ダイレクト", "ツー") and name not in players: players.append(name)
+    s = elog.state
+    state = {"score": s["score"], "rotation": lineup.order(s["lineup"]), "phase": s["phase"], "set_name": first["set"],
+             "video_url": first["video_url"], "liberos": [], "setter_counts": s["setter_counts"],
+             "player_counts": s["player_counts"], "all_players": players,
+             "custom_combo_pool": s["custom_combo_pool"], "stage": 6}
+    return log, elog, state, mismatch
+
+# ★ 空いているIDを取る（退避済みのIDも使用中）。ロックファイルの排他作成で確保するので、並列に取り込んでも同じIDにならない
+def claim_id(start):
+    gid = start
+    while True:
+        sid = f"{gid:05d}"
+        if not os.path.exists(storage.state_file(sid)) and not archive.archived(sid):
+            try:
+                os.close(os.open(storage.lock_file(sid), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                return sid
+            except FileExistsError:
+                pass
+        gid += 1
+
+def save(game_id, log, elog, state):
+    storage.Journal(game_id).create(log, state, elog)
+    game_index.upsert(game_id, state["set_name"], state["score"], len(log))
+
+# ★ 1ファイル分（ワーカープロセスで実行）。戻り値は結果の dict のリスト
+def import_file(path, start_id=START_ID, skip_invalid=False, dry_run=False):
+    try:
+        sets, errors = read_sets(path, skip_invalid)
+    except (InvalidExport, OSError, StopIteration) as e:
+        return [{"file": path, "error": str(e)}]
+    except Exception as e:  # 壊れたブックなど
+        return [{"file": path, "error": f"{type(e).__name__}: {e}"}]
+    out, done = [], []
+    gid = None if dry_run or not sets else claim_id(start_id)
+    for i, (set_name, rows) in enumerate(sets.items(), start=1):
+        log, elog, state, mismatch = replay(rows)
+        if gid and i < len(sets):
+            done.append(storage.write_set(gid, i, log, state, elog))
+        elif gid:
+            state["sets"] = done
+            save(gid, log, elog, state)
+        out.append({"file": path, "game_id": gid, "set": set_name, "rows": len(log), "score": state["score"],
+                    "skipped": len(errors), "mismatch": mismatch})
+    return out
+
+def expand(paths):
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(glob.glob(os.path.join(p, "scout_set*.xlsx")) + glob.glob(os.path.join(p, "scout_set*.csv")))
+        else:
+            files.append(p)
+    return files
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="scout_set*.xlsx / .csv を保存データに取り込む")
+    ap.add_argument("paths", nargs="+")
+    ap.add_argument("--start-id", type=int, default=START_ID, help="この番号から空いているIDを使う")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--skip-invalid", action="store_true", help="不正な行を飛ばして取り込む（既定はファイルごと取り込まない）")
+    ap.add_argument("--dry-run", action="store_true", help="検査と再生だけ行い、保存しない")
+    args = ap.parse_args()
+    files = expand(args.paths)
+    game_index.ensure_index()
+    failed = 0
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(import_file, f, args.start_id, args.skip_invalid, args.dry_run) for f in files]
+        for fut in as_completed(futures):
+            for r in fut.result():
+                if "error" in r:
+                    failed += 1
+                    print(f"NG  {r['file']}: {r['error']}")
+                else:
+                    note = "".join([f"  不正行 {r['skipped']} 件を除外" if r["skipped"] else "",
+                                    f"  補えなかった不一致 {r['mismatch']} 件" if r["mismatch"] else ""])
+                    print(f"OK  {r['file']} Set{r['set']} -> ID {r['game_id'] or '-'}  "
+                          f"{r['rows']}行 {r['score'][0]}-{r['score'][1]}{note}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,59 @@
+# ★ コート上の6人（イベント列の状態に入れるので JSON にできる dict で持つ）
+#   slots: 開始時のサーブ順の6人（交代はその枠を書き換える）/ rot: 何回ローテしたか（0〜5）
+#   slot: 選手名 → 枠番号（交代で OUT の選手を探さない）/ libero: コートにいるリベロ → 代わりに下がった選手
+#   subs: 交代の記録 [OUT, IN]（リベロの入れ替えは数えない）
+#   ローテは rot を1つ進めるだけ、ポジション n の選手は slots[(INDEX[n] - rot) % 6]
+POS_COLUMNS = ["pos1", "pos2", "pos3", "pos4", "pos5", "pos6"]
+# ポジション → 開始時の並びの添字: r[0]=P1, r[5]=P2, r[4]=P3, r[3]=P4, r[2]=P5, r[1]=P6
+INDEX = {1: 0, 2: 5, 3: 4, 4: 3, 5: 2, 6: 1}
+FRONT = (2, 3, 4)
+
+def new(order):
+    slots = (list(order) + [""] * 6)[:6]
+    return {"slots": slots, "rot": 0, "slot": {p: i for i, p in enumerate(slots) if p}, "libero": {}, "subs": []}
+
+def at(lu, pos):
+    return lu["slots"][(INDEX[pos] - lu["rot"]) % 6]
+
+# ★ 旧形式と同じ並び（[0]=①, [1]=⑥, [2]=⑤, [3]=④, [4]=③, [5]=②）
+def order(lu):
+    s, k = lu["slots"], lu["rot"]
+    return s[-k:] + s[:-k] if k else list(s)
+
+# ★ 記録行の pos1〜pos6
+def positions(lu):
+    s, k = lu["slots"], lu["rot"]
+    return {f"pos{p}": s[(i - k) % 6] for p, i in INDEX.items()}
+
+# ★ 記録行に今のポジションを入れる（att_phase の前。commit_record の列順と同じ）
+def stamp(row, lu):
+    out = {}
+    for k, v in row.items():
+        if k == "att_phase": out.update(positions(lu))
+        if k not in POS_COLUMNS: out[k] = v
+    if "pos1" not in out: out.update(positions(lu))
+    return out
+
+# ★ ローテ。前衛(④)に上がるリベロは代わりに下がっていた選手と自動で入れ替える
+def rotate(lu):
+    lu["rot"] = (lu["rot"] + 1) % 6
+    p4 = at(lu, 4)
+    if p4 in lu["libero"]:
+        _swap(lu, p4, lu["libero"].pop(p4))
+
+def _swap(lu, out_p, in_p):
+    i = lu["slot"].pop(out_p, None)
+    if i is None:
+        return False
+    lu["slots"][i] = in_p
+    if in_p: lu["slot"][in_p] = i
+    return True
+
+# ★ 交代。libero=True ならリベロの入れ替え（交代回数に数えない）。OUT がコートにいなければ何もしない
+def sub(lu, out_p, in_p, libero=False):
+    if out_p in lu["libero"]:
+        lu["libero"].pop(out_p)
+        _swap(lu, out_p, in_p)
+    elif _swap(lu, out_p, in_p):
+        if libero: lu["libero"][in_p] = out_p
+        else: lu["subs"].append([out_p, in_p])
@@ -0,0 +1,96 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+# ★ 重い処理の計測（SCOUT_PROFILE=1 で起動した時だけ有効）
+#   無効時: timed() は関数をそのまま返し、span() は共有の何もしないコンテキストを返すだけ
+ENABLED = os.environ.get("SCOUT_PROFILE", "") not in ("", "0")
+RING_SIZE = 300  # 保持するリラン数
+
+_local = threading.local()
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullSpan()
+
+# ★ 1セッション分の記録。リランごとに {区間名: [ms, ...]} を持つ dict をリングバッファに積む
+class Profile:
+    def __init__(self, size=RING_SIZE):
+        self.runs = collections.deque(maxlen=size)
+        self.started = time.time()
+
+    def summary(self):
+        samples = {}
+        for run in self.runs:
+            samples.setdefault("rerun", []).append(run["total_ms"])
+            for name, ms in run["spans"].items():
+                samples.setdefault(name, []).extend(ms)
+        out = {}
+        for name, v in sorted(samples.items()):
+            s = sorted(v)
+            at = lambda p: s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
+            out[name] = {"n": len(s), "p50": round(at(50), 2), "p95": round(at(95), 2), "max": round(s[-1], 2),
+                         "total": round(sum(s), 1)}
+        return out
+
+    def dump(self):
+        return json.dumps({"started": self.started, "ring_size": self.runs.maxlen, "runs": list(self.runs),
+                           "summary": self.summary()}, ensure_ascii=False, indent=1)
+
+# ★ リランの開始/終了。st.rerun() で途中終了したリランは次の begin で閉じる（interrupted=True）
+def begin_rerun(profile, label=""):
+    if getattr(_local, "run", None) is not None:
+        end_rerun(interrupted=True)
+    _local.profile = profile
+    _local.run = {"at": time.time(), "label": label, "spans": {}, "_t0": time.perf_counter()}
+
+def end_rerun(interrupted=False):
+    run = getattr(_local, "run", None)
+    if run is None:
+        return
+    run["total_ms"] = round((time.perf_counter() - run.pop("_t0")) * 1000, 3)
+    if interrupted: run["interrupted"] = True
+    _local.profile.runs.append(run)
+    _local.run = None
+
+def record(name, ms):
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run["spans"].setdefault(name, []).append(round(ms, 3))
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, (time.perf_counter() - self.t0) * 1000)
+        return False
+
+def span(name):
+    return _Span(name) if ENABLED else _NULL
+
+def timed(name):
+    def deco(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
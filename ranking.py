@@ -0,0 +1,32 @@
+# ★ 使用回数の多い順の並びを、回数が1増えるたびに O(1) で保つ（候補ボタンを毎回ソートしない）
+#   order: 回数の多い順の名前 / at: 名前 → order の添字 / top[c]: 回数が c より多い名前の数（= 回数 c の先頭の添字）
+#   回数 c の名前を1増やす時は、回数 c の先頭と入れ替えて top[c] を1進めるだけ
+#   イベント列の状態に入れるので JSON にできる dict で持つ（回数そのものは *_counts の dict 側）
+
+def new(counts=None):
+    r = {"order": [], "at": {}, "top": []}
+    for name, c in sorted((counts or {}).items(), key=lambda x: -x[1]):
+        if c > 0:
+            r["at"][name] = len(r["order"])
+            r["order"].append(name)
+    cs = [counts[n] for n in r["order"]]
+    r["top"] = [sum(1 for x in cs if x > c) for c in range(max(cs, default=0))]
+    return r
+
+# ★ c は増やす前の回数
+def bump(r, name, c):
+    order, at, top = r["order"], r["at"], r["top"]
+    if name not in at:
+        at[name] = len(order)
+        order.append(name)
+    if len(top) <= c:
+        top.extend([0] * (c + 1 - len(top)))
+    i, j = at[name], top[c]
+    order[i], order[j] = order[j], order[i]
+    at[order[i]], at[name] = i, j
+    top[c] += 1
+
+# ★ members を回数の多い順に（回数0の名前は members の順で後ろに）
+def ranked(r, members):
+    allowed = set(members)
+    return [n for n in r["order"] if n in allowed] + [n for n in members if n not in r["at"]]
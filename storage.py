@@ -0,0 +1,555 @@
+import contextlib
+import copy
+import glob
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+try:
+    import fcntl
+except ImportError:  # Windows: ロックなし
+    fcntl = None
+import background
+import columnar
+import game_index
+import lineup
+from datalog import DataLog
+from events import EventLog, undo_event, redo_event, position_columns, row_count
+
+# ★ ジャーナルがこの行数を超えたらCSV/JSONのスナップショットに書き出して空にする
+JOURNAL_COMPACT_EVERY = 200
+# ★ リラン末尾の保存を見送る最短間隔（秒）。0なら毎リラン書く。st.rerun() 前は常に書く
+SAVE_IDLE_SEC = 0.0
+# ★ ジャーナル追記の fsync はこの間隔（秒）にまとめる。スナップショットは常に fsync してから置き換える
+FSYNC_INTERVAL = 1.0
+# ★ 圧縮後もジャーナルに残す直近の行数。少し遅れている別端末が差分だけで追い付ける（再生時は seq 以下なので読み飛ばされる）
+JOURNAL_KEEP = 100
+# ★ 記録画面で他の端末の追記を確認する間隔（秒）
+SYNC_POLL_SEC = 2.0
+# ★ 保存を背景スレッドで行うか（False なら従来どおりリランの中で書き切る）
+ASYNC_SAVE = True
+# ★ スナップショットの記録行の形式。"arrow" は pyarrow がある時だけ有効（無ければCSV）
+SAVE_FORMAT = "csv"
+
+# ★ ID別のファイル名を返す（複数人が同時に別IDで作業できる）
+def data_file(game_id):
+    return f"autosave_data_{game_id}.csv"
+
+def state_file(game_id):
+    return f"autosave_state_{game_id}.json"
+
+def journal_file(game_id):
+    return f"autosave_journal_{game_id}.jsonl"
+
+def lock_file(game_id):
+    return f"autosave_{game_id}.lock"
+
+# ★ 終了したセット n の凍結ファイル（gzip圧縮JSON、一度書いたら書き換えない）
+def set_file(game_id, n):
+    return f"autosave_set_{game_id}_{n}.json.gz"
+
+# ★ 別のタブ/端末が同じIDに後から書き込んでいた（こちらの状態は古い）
+class StaleWriterError(Exception):
+    pass
+
+# ★ 一時ファイルに書いて fsync してから rename。途中で落ちても元のファイルは壊れない
+def atomic_write(path, write, binary=False):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8', newline='')) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+# ★ スナップショットの記録行を DataFrame で読む（.arrow があれば優先）。columns で列を絞れる。無ければ None
+def read_snapshot(game_id, columns=None):
+    if columnar.available() and os.path.exists(columnar.arrow_file(game_id)):
+        return columnar.read(columnar.arrow_file(game_id), columns)
+    if os.path.exists(data_file(game_id)):
+        import pandas as pd
+        return pd.read_csv(data_file(game_id), usecols=(lambda c: c in columns) if columns is not None else None)
+    return None
+
+# ★ pos1〜pos6 はイベント列から作り直せる時（全行で一致する時）だけスナップショットから外す
+def _slim_frame(rows, elog):
+    df = rows.frame()
+    if elog is None or "pos1" not in rows.columns or row_count(elog) != len(rows):
+        return df
+    if position_columns(elog) != {c: rows.columns[c] for c in lineup.POS_COLUMNS}:
+        return df
+    return df.drop(columns=lineup.POS_COLUMNS)
+
+# ★ その試合のスナップショットの形式（.arrow があれば "arrow"、無ければ SAVE_FORMAT）
+def snapshot_format(game_id):
+    return "arrow" if os.path.exists(columnar.arrow_file(game_id)) else SAVE_FORMAT
+
+def _write_snapshot(game_id, rows, fmt=None, elog=None):
+    use_arrow = (fmt or SAVE_FORMAT) == "arrow" and columnar.available()
+    path, other = (columnar.arrow_file(game_id), data_file(game_id)) if use_arrow else (data_file(game_id), columnar.arrow_file(game_id))
+    if len(rows) > 0:
+        df = _slim_frame(rows, elog)
+        if use_arrow: atomic_write(path, lambda f: columnar.write(f, df), binary=True)
+        else: atomic_write(path, lambda f: df.to_csv(f, index=False))
+    elif os.path.exists(path):
+        os.remove(path)
+    if os.path.exists(other):
+        os.remove(other)
+
+# ★ このIDの保存ファイル（凍結セットも含む。ロックファイルは最後）
+def game_files(game_id):
+    sets = [p for p in glob.glob(f"autosave_set_{glob.escape(game_id)}_*.json.gz")
+            if re.fullmatch(rf"autosave_set_{re.escape(game_id)}_\d+\.json\.gz", os.path.basename(p))]
+    files = [state_file(game_id), data_file(game_id), columnar.arrow_file(game_id), journal_file(game_id)] + sorted(sets)
+    return [p for p in files + [lock_file(game_id)] if os.path.exists(p)]
+
+# ★ IDごとの助言ロック（flock）。ロックファイルの中身は最後に書いた writer と seq
+#   flock はオープンごとに効くので、同じプロセス内の別セッション同士でも排他になる
+@contextlib.contextmanager
+def game_lock(game_id):
+    fd = os.open(lock_file(game_id), os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, 'r+') as f:
+        if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read_head(f):
+    f.seek(0)
+    try:
+        return json.loads(f.read() or "{}")
+    except ValueError:
+        return {}
+
+def _write_head(f, writer, seq):
+    f.seek(0); f.truncate()
+    f.write(json.dumps({"writer": writer, "seq": seq, "time": time.time()}))
+    f.flush()
+
+# ★ 背景の保存（Journal.submit）の列。読み直し・差分の取り込み・セット終了の前に drain() で書き終わるのを待つ
+def save_lane(game_id):
+    return f"save:{game_id}"
+
+def drain(game_id):
+    background.drain(save_lane(game_id))
+
+def saving(game_id):
+    return not background.idle(save_lane(game_id))
+
+# ★ 背景の保存で起きた想定外の例外（ディスクが一杯など）。呼び出し側で表示する
+def save_errors(game_id):
+    return background.errors(save_lane(game_id))
+
+# ★ 後追いの fsync の列（保存の列とは別。待っている間に保存を止めない）
+def fsync_lane(game_id):
+    return f"fsync:{game_id}"
+
+# ★ ジャーナルへの追記。前回の fsync から FSYNC_INTERVAL 経っていなければ、その場では fsync せず間隔の後に1回まとめて行う
+#   途中で失敗したら（ディスクが一杯など）書きかけを切り詰めてから例外を上げる（末尾に半端な行を残さない）
+def _append(path, data, journal):
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        start = os.fstat(fd).st_size
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if time.monotonic() - journal.last_fsync >= FSYNC_INTERVAL:
+                os.fsync(fd)
+                journal.last_fsync, journal.unsynced = time.monotonic(), False
+            else:
+                journal.unsynced = True
+                journal.schedule_fsync()
+        except OSError:
+            os.ftruncate(fd, start)
+            raise
+    finally:
+        os.close(fd)
+
+# ★ 変更通知: ロックファイルの seq をロックを取らずに読むだけ（同じIDを見ている端末がリランごとに見比べる）
+def head_seq(game_id):
+    try:
+        with open(lock_file(game_id), 'r') as f:
+            return json.loads(f.read() or "{}").get("seq")
+    except (OSError, ValueError):
+        return None
+
+# ★ ジャーナルの完全な行を (op, バイト数) で返す。書き込み途中で落ちた末尾行の手前で止まる
+def _iter_journal(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                if not line.endswith(b"\n"): raise ValueError
+                op = json.loads(line)
+            except ValueError:
+                return
+            yield op, len(line)
+
+# ★ ジャーナル1行を適用する。新しい EventLog（"start"）を返すこともある
+#   "ev" の記録行のポジションはその時点のラインナップから入れ直す（ジャーナルには pos1〜pos6 を書かない）
+#   イベント列の無い所（セットアップ途中）に来たイベント系の op は読み飛ばす（保存を読めなくしない）
+def apply_op(op, rows, elog, state, pick=lambda row: row):
+    if op["op"] == "start": elog = EventLog(op["init"])
+    elif op["op"] in ("ev", "undo", "redo") and elog is None: pass
+    elif op["op"] == "ev":
+        if op["row"] is not None: rows.append(pick(lineup.stamp(op["row"], elog.state["lineup"])))
+        elog.push(op["ev"])
+    elif op["op"] == "undo": undo_event(elog, rows)
+    elif op["op"] == "redo": redo_event(elog, rows)
+    elif op["op"] == "row": rows.append(pick(op["row"]))
+    elif op["op"] == "pop" and len(rows): rows.pop()
+    elif op["op"] == "state": state.update(op["state"])
+    return elog
+
+# ★ 追記専用ジャーナル。1タップ＝数行の追記だけで済み、試合が長くなっても保存コストが一定
+#   op: {"op": "start", "init": {...}} 試合開始（イベント列の初期状態）
+#       {"op": "ev", "ev": {...}, "row": {...}/None} イベント（記録行を伴う場合は row） / {"op": "undo"} / {"op": "redo"}
+#       {"op": "state", "state": {...}} 状態更新 / {"op": "row"}・{"op": "pop"} 旧形式の行追加・削除
+#   各行に連番 n を振り、スナップショット側の seq 以下の行は再生時に読み飛ばす（圧縮途中で落ちても二重適用しない）
+#   書き込みは game_lock の中で行い、ロックファイルの seq が自分の知っている seq と違えば別の writer がいたとみなす
+#   複数端末で1試合を入力する時は、書く前に changes() で他の端末の追記を取り込んでから追記する（楽観的な追記）
+class Journal:
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.seq = 0
+        self.pending = 0  # 前回の圧縮以降に追記した行数
+        self.writer = uuid.uuid4().hex
+        self.last_fsync = 0.0
+        self.lane = save_lane(game_id)
+        self.queued = 0   # 前回の圧縮依頼以降に背景へ渡した op 数
+        self.outbox = []  # 背景でまだ書いていない保存（submit 1回分ずつ）
+        self.posted = False
+        self.outbox_lock = threading.Lock()
+        self.failed = []  # 背景の書き込みで古い writer と判定された op（投入順）
+        self.unsynced = False       # fsync していない追記がある
+        self.fsync_posted = False   # 後追いの fsync を依頼済み
+
+    def _check_stale(self, lock):
+        head = _read_head(lock)
+        if (head.get("writer") not in (None, self.writer) and head.get("seq", 0) != self.seq
+                and os.path.exists(state_file(self.game_id))):
+            raise StaleWriterError(self.game_id)
+
+    # ★ compact: None なら溜まった行数で決める / True・False なら呼び出し側の判断（背景の保存で使う）
+    #   index: 索引を更新するか（nrows は索引の行数。rows を渡さない時に使う）
+    def write(self, ops, rows, state, elog, compact=None, index=True, nrows=None):
+        with game_lock(self.game_id) as lock:
+            self._check_stale(lock)
+            if ops:
+                lines, seq = [], self.seq
+                for op in ops:
+                    seq += 1
+                    if op["op"] == "ev" and op["row"] is not None:
+                        op = dict(op, row={k: v for k, v in op["row"].items() if k not in lineup.POS_COLUMNS})
+                    lines.append(json.dumps(dict(op, n=seq), ensure_ascii=False))
+                _append(journal_file(self.game_id), ("\n".join(lines) + "\n").encode("utf-8"), self)
+                self.seq = seq  # 追記できてから進める（失敗した op は呼び出し側が同じ番号で書き直す）
+                self.pending += len(lines)
+            if compact is None:
+                compact = self.pending >= JOURNAL_COMPACT_EVERY or not os.path.exists(state_file(self.game_id))
+            if compact:
+                self.compact(rows, state, elog)
+            _write_head(lock, self.writer, self.seq)
+        if index:
+            game_index.upsert(self.game_id, state.get("set_name", ""), state.get("score", [0, 0]),
+                              len(rows) if nrows is None else nrows)
+
+    # ★ 背景スレッドで write する（outbox に積んで戻る）。同じIDの保存は投入順
+    #   この後も書き換わる ops・state はここで写しを取る。rows・elog は圧縮する回だけ写す（圧縮の要否もここで決める）
+    #   背景の1回の仕事は、それまでに積まれた分をまとめて書く（ロック・追記・索引の更新が1回で済む）
+    #   outbox が QUEUE_MAX 回分溜まっていたら書き終わるまで待つ
+    def submit(self, ops, rows, state, elog):
+        if len(self.outbox) >= background.QUEUE_MAX:
+            self.drain()
+        compact = self.queued + len(ops) >= JOURNAL_COMPACT_EVERY or not os.path.exists(state_file(self.game_id))
+        self.queued = 0 if compact else self.queued + len(ops)
+        ops, state = copy.deepcopy((ops, state))
+        snap = (rows.copy(), elog and elog.snapshot()) if compact else (None, None)
+        with self.outbox_lock:
+            self.outbox.append((ops, state, *snap, compact, len(rows)))
+            if self.posted:
+                return
+            self.posted = True
+        background.submit(self.lane, self._write_job)
+
+    # ★ 圧縮を頼まれた回ごとに区切って書く（スナップショットの seq がその回までの op と一致するように）
+    #   古い writer と判定されたら、残りの op を failed に溜めて書かない（呼び出し側が積み直す）
+    #   それ以外の失敗（ディスクが一杯・索引のロック等）では、まだ追記できていない op と残りの分を outbox の先頭に戻して
+    #   例外を上げる（save_errors に出る。次の保存でもう一度書く）。追記の後の圧縮だけが失敗した時は次の保存で圧縮し直す
+    def _write_job(self):
+        with self.outbox_lock:
+            batch, self.outbox, self.posted = self.outbox, [], False
+        pending = []
+        for i, (ops, state, rows, elog, compact, nrows) in enumerate(batch):
+            pending += ops
+            if self.failed:
+                continue
+            if compact or i == len(batch) - 1:
+                seq = self.seq
+                try:
+                    self.write(pending, rows, state, elog, compact, i == len(batch) - 1, nrows)
+                except StaleWriterError:
+                    self.failed.extend(pending)
+                except Exception:
+                    retry = [] if self.seq != seq else [(pending, state, rows, elog, compact, nrows)]
+                    if compact and self.seq != seq:
+                        self.queued = JOURNAL_COMPACT_EVERY
+                    with self.outbox_lock:
+                        self.outbox[:0] = retry + batch[i + 1:]
+                    raise
+                pending = []
+        self.failed.extend(pending)
+
+    # ★ 書けずに戻された保存が outbox に残っていて、背景の仕事が出ていなければ出し直す（新しいタップが無くても再試行する）
+    def retry(self):
+        with self.outbox_lock:
+            if not self.outbox or self.posted:
+                return False
+            self.posted = True
+        background.submit(self.lane, self._write_job)
+        return True
+
+    def drain(self):
+        background.drain(self.lane)
+
+    # ★ 後追いの fsync: FSYNC_INTERVAL 後にまだ fsync していない追記があればジャーナルを fsync する
+    #   連続したタップの最後の数件も、次の書き込みを待たずに間隔以内でディスクに載る（終了時は atexit の drain_all で待つ）
+    def schedule_fsync(self):
+        if self.fsync_posted:
+            return
+        self.fsync_posted = True
+
+        def sync():
+            self.fsync_posted = False
+            if not self.unsynced:
+                return
+            self.unsynced = False
+            try:
+                fd = os.open(journal_file(self.game_id), os.O_RDONLY)
+            except FileNotFoundError:
+                return
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.last_fsync = time.monotonic()
+        background.submit_idle(fsync_lane(self.game_id), FSYNC_INTERVAL, lambda: True, sync)
+
+    # ★ 書けなかった op を取り出す（無ければ空リスト）
+    def take_failed(self):
+        if not self.failed:
+            return []
+        self.drain()
+        out, self.failed = self.failed, []
+        return out
+
+    # ★ セット終了: 終わったセットを凍結ファイルに書き出し、次のセットの状態（rows は空）で圧縮し直す
+    #   state["sets"] に凍結したセットの目録を足して返す。以降の保存・メモリは進行中のセットの分だけ
+    def finish_set(self, done_rows, done_state, done_elog, rows, state):
+        with game_lock(self.game_id) as lock:
+            self._check_stale(lock)
+            entry = write_set(self.game_id, len(state.get("sets", [])) + 1, done_rows, done_state, done_elog)
+            state["sets"] = state.get("sets", []) + [entry]
+            self.seq += 1
+            self.compact(rows, state, None)
+            _write_head(lock, self.writer, self.seq)
+        game_index.upsert(self.game_id, state.get("set_name", ""), state.get("score", [0, 0]), len(rows))
+        return entry
+
+    # ★ 自分の seq より後に他の端末が追記した op を返して seq を進める（game_lock の中で読む）
+    #   ジャーナルに途切れなく残っていなければ None（セット終了・圧縮で消えた等。呼び出し側で読み直す）
+    def changes(self):
+        with game_lock(self.game_id) as lock:
+            seq = _read_head(lock).get("seq", 0)
+            if seq == self.seq:
+                return []
+            ops = [op for op, _ in _iter_journal(journal_file(self.game_id)) if op.get("n", 0) > self.seq]
+            if not ops or ops[0]["n"] != self.seq + 1 or ops[-1]["n"] != seq:
+                return None
+            self.seq = seq
+            self.pending += len(ops)
+            return ops
+
+    # ★ 全行をCSV、状態とイベント列をJSONに書き出し、ジャーナルは直近 JOURNAL_KEEP 行だけ残す（game_lock の中で呼ぶ）
+    #   fmt を省略した時は今のスナップショットの形式のまま（columnar.py で .arrow にした試合をCSVに戻さない）
+    def compact(self, rows, state, elog, fmt=None):
+        _write_snapshot(self.game_id, rows, fmt or snapshot_format(self.game_id), elog)
+        snapshot = dict(state, seq=self.seq)
+        if elog is not None: snapshot["events"] = elog.to_dict()
+        atomic_write(state_file(self.game_id), lambda f: json.dump(snapshot, f))
+        jf = journal_file(self.game_id)
+        tail = [json.dumps(op, ensure_ascii=False) + "\n" for op, _ in _iter_journal(jf)][-JOURNAL_KEEP:] if JOURNAL_KEEP else []
+        atomic_write(jf, lambda f: f.writelines(tail))
+        self.pending = 0
+
+    # ★ スナップショットを読み、ジャーナルを再生して (DataLog, state, EventLog) を返す。保存が無ければ None
+    #   EventLog は試合開始前の保存や旧形式の保存では None。claim=False なら読むだけ（writer にならない）
+    #   columns を渡すと記録行はその列だけ読む（集計用。再開には使わない）
+    def load(self, claim=True, columns=None):
+        with game_lock(self.game_id) as lock:
+            loaded = self._load(columns)
+            if loaded is not None and claim:
+                _write_head(lock, self.writer, self.seq)
+            return loaded
+
+    # ★ まだ保存の無いIDに1から書く（取り込み・退避からの戻し）。既に保存があれば FileExistsError
+    def create(self, rows, state, elog, fmt=None, seq=0):
+        with game_lock(self.game_id) as lock:
+            if os.path.exists(state_file(self.game_id)):
+                raise FileExistsError(state_file(self.game_id))
+            self.seq = seq
+            self.compact(rows, state, elog, fmt)
+            _write_head(lock, self.writer, self.seq)
+
+    # ★ 保存を読んで fn(rows, state, elog) に渡し、fn が例外なく戻ったらこのIDの保存ファイルを全部消して索引から外す（退避用）
+    #   背景の保存を書き終えてから、読む〜消すまで game_lock を取ったまま。fn の戻り値を返す（保存が無ければ None）
+    def retire(self, fn):
+        drain(self.game_id)
+        with game_lock(self.game_id):
+            loaded = self._load()
+            if loaded is None:
+                return None
+            out = fn(*loaded)
+            for path in game_files(self.game_id):
+                os.remove(path)  # 状態ファイルが先（途中で落ちても「保存なし」に見えるだけ）
+        game_index.remove(self.game_id)
+        return out
+
+    # ★ 保存済みの記録行（凍結セットも含む）を fn(DataLog) で書き換えて書き戻す（一括再処理用）。書き換えた行数を返す
+    #   凍結セットはファイルごと置き換える。seq を1つ進めるので、同じIDを開いているセッションは次の保存で古いと判定され読み直しになる
+    def rewrite_rows(self, fn):
+        with game_lock(self.game_id) as lock:
+            loaded = self._load()
+            if loaded is None:
+                return 0
+            rows, state, elog = loaded
+            done = sum(_rewrite_set(entry, fn) for entry in state.get("sets", []))
+            fn(rows)
+            self.seq += 1
+            self.compact(rows, state, elog)
+            _write_head(lock, self.writer, self.seq)
+            return done + len(rows)
+
+    def _load(self, columns=None):
+        sf = state_file(self.game_id)
+        if not os.path.exists(sf):
+            return None
+        df = read_snapshot(self.game_id, columns)
+        rows = DataLog() if df is None else DataLog.from_frame(df)
+        pick = (lambda row: {k: row[k] for k in columns if k in row}) if columns is not None else (lambda row: row)
+        with open(sf, 'r') as f:
+            state = json.load(f)
+        self.seq = state.pop("seq", 0)
+        elog = EventLog.from_dict(state.pop("events")) if "events" in state else None
+        if elog is not None and "pos1" not in rows.columns and (columns is None or "pos1" in columns):
+            restamp(rows, elog)
+        self.pending = 0
+        jf = journal_file(self.game_id)
+        if os.path.exists(jf):
+            good = 0
+            for op, size in _iter_journal(jf):
+                good += size
+                if op.get("n", 0) <= self.seq:
+                    continue
+                self.seq = op["n"]; self.pending += 1
+                elog = apply_op(op, rows, elog, state, pick)
+            if good < os.path.getsize(jf):
+                os.truncate(jf, good)  # 書き込み途中で落ちた末尾行を切り捨て、次の追記が混ざらないようにする
+        if columns is not None:
+            for k in [k for k in rows.columns if k not in columns]:
+                del rows.columns[k]  # Redo用に退避していた行などから増えた列
+        return rows, state, elog
+
+# ★ スナップショットで外したポジション列をイベント列から戻す（列順は commit_record と同じく att_phase の前）
+def restamp(rows, elog):
+    if row_count(elog) != len(rows) or len(rows) == 0:
+        return
+    pos = position_columns(elog)
+    cols = {}
+    for c, v in rows.columns.items():
+        if c == "att_phase": cols.update(pos)
+        cols[c] = v
+    if "pos1" not in cols: cols.update(pos)
+    rows.columns = cols
+
+# ★ 凍結セットの書き出し。既にあれば（書き出し直後に落ちた再試行など）書き換えずにそのまま使う
+def write_set(game_id, n, rows, state, elog):
+    path = set_file(game_id, n)
+    if not os.path.exists(path):
+        body = {"set_name": state.get("set_name", ""), "state": state, "columns": rows.columns, "length": len(rows),
+                "events": elog.to_dict() if elog is not None else None}
+        _write_set_body(path, body)
+    return {"n": n, "set_name": state.get("set_name", ""), "score": state.get("score", [0, 0]), "rows": len(rows),
+            "file": path}
+
+def _write_set_body(path, body):
+    atomic_write(path, lambda f: f.write(gzip.compress(json.dumps(body, ensure_ascii=False).encode("utf-8"))), binary=True)
+
+# ★ 凍結セットの記録行を fn(DataLog) で書き換えて置き換える（rewrite_rows から game_lock の中で呼ぶ）
+def _rewrite_set(entry, fn):
+    with open(entry["file"], "rb") as f:
+        body = json.loads(gzip.decompress(f.read()))
+    log = DataLog()
+    log.columns, log.length = body["columns"], body["length"]
+    fn(log)
+    body["columns"] = log.columns
+    _write_set_body(entry["file"], body)
+    return len(log)
+
+def read_set(entry, columns=None):
+    with open(entry["file"], "rb") as f:
+        body = json.loads(gzip.decompress(f.read()))
+    log = DataLog()
+    log.columns = {c: v for c, v in body["columns"].items() if columns is None or c in columns}
+    log.length = body["length"]
+    return log
+
+# ★ 試合全体の記録行（凍結セット + 進行中のセット）。書き出し・集計の時だけ作る
+def match_log(sets, rows, columns=None):
+    if not sets:
+        return rows
+    parts = [read_set(e, columns) for e in sets] + [rows]
+    out = DataLog()
+    for part in parts:
+        for c in part.columns:
+            out.columns.setdefault(c, [])
+    for part in parts:
+        for c, col in out.columns.items():
+            col.extend(part.columns.get(c, [""] * len(part)))
+    out.length = sum(len(p) for p in parts)
+    return out
+
+# ★ 保存要求をまとめる。mark()で汚れ印を付け、due()がTrueの時だけ実際に書いて done() を呼ぶ
+class SaveCoalescer:
+    def __init__(self, idle_sec=0.0):
+        self.idle_sec = idle_sec
+        self.dirty = False
+        self.requests = 0  # auto_save() の呼び出し回数
+        self.writes = 0    # 実際に書き込んだ回数
+        self.last_write = 0.0
+
+    def mark(self):
+        self.dirty = True
+        self.requests += 1
+
+    def due(self, force=False):
+        return self.dirty and (force or time.monotonic() - self.last_write >= self.idle_sec)
+
+    def done(self):
+        self.dirty = False
+        self.writes += 1
+        self.last_write = time.monotonic()
+
+    @property
+    def coalesced(self):
+        return self.requests - self.writes
@@ -0,0 +1,65 @@
+import glob
+import os
+import numpy as np
+
+# ★ コート座標 → ゾーン番号（配列でまとめて計算。入力画面の1点もこれを使う）
+#   自陣(y<9)側を下にした座標系。y 0〜9 を3行、9〜18 を 9〜13.5 / 13.5〜18 の2行に分ける
+NEAR = np.array([[5, 6, 1], [7, 8, 9], [4, 3, 2]])
+FAR = np.array([[2, 3, 4], [1, 6, 5]])
+
+def _arr(v):
+    return np.asarray(v, dtype=float).reshape(-1)
+
+# ★ NaN（未入力）は ""、コート外は "Out"
+def zones(x, y):
+    x, y = _arr(x), _arr(y)
+    missing = np.isnan(x) | np.isnan(y)
+    x0, y0 = np.nan_to_num(x), np.nan_to_num(y)
+    r = (np.clip(y0, 0, 17.99) // 3).astype(int)
+    c = (np.clip(x0, 0, 8.99) // 3).astype(int)
+    z = np.where(r < 3, NEAR[np.minimum(r, 2), c], FAR[(y0 >= 13.5).astype(int), c]).astype(str)
+    z = np.where((x0 < 0) | (x0 > 9) | (y0 < 0) | (y0 > 18), "Out", z)
+    return np.where(missing, "", z)
+
+# ★ 下→上のプレーを上→下向きにそろえる（始点が自陣側なら始点・終点とも180度回す）
+#   始点・終点あり: 始点y < 終点y かつ 始点y < 9 / 始点のみ: 始点y < 9
+def normalize(sx, sy, ex, ey):
+    sx, sy, ex, ey = _arr(sx), _arr(sy), _arr(ex), _arr(ey)
+    has_s, has_e = ~np.isnan(sy), ~np.isnan(ey)
+    flip = has_s & (sy < 9) & (~has_e | (sy < ey))
+    fe = flip & has_e
+    return (np.where(flip, 9.0 - sx, sx), np.where(flip, 18.0 - sy, sy),
+            np.where(fe, 9.0 - ex, ex), np.where(fe, 18.0 - ey, ey))
+
+def _num(v):
+    return np.nan if v == "" else v
+
+def _out(v):
+    return "" if np.isnan(v) else float(v)
+
+# ★ 入力画面用: points（[(px, py, lx, ly), ...]）から正規化済みの座標とゾーンを返す（未入力は ""）
+def locate(points):
+    s = points[0][2:4] if len(points) >= 1 else ("", "")
+    e = points[1][2:4] if len(points) >= 2 else ("", "")
+    sx, sy, ex, ey = normalize(*(_num(v) for v in (*s, *e)))
+    s_z, e_z = zones(sx, sy)[0], zones(ex, ey)[0]
+    return _out(sx[0]), _out(sy[0]), _out(ex[0]), _out(ey[0]), str(s_z), str(e_z)
+
+# ★ 記録済みの行（座標は正規化済み）からゾーン列を計算し直す。DataLog の列をその場で書き換える
+#   反転はすでに適用された座標しか残っていないので、ここではゾーン分けだけをやり直す
+def rezone(log):
+    if len(log) == 0 or "start_x" not in log.columns:
+        return
+    cols = log.columns
+    to_f = lambda name: np.array([np.nan if v == "" or v is None else v for v in cols[name]], dtype=float)
+    cols["start_zone"] = zones(to_f("start_x"), to_f("start_y")).tolist()
+    cols["end_zone"] = zones(to_f("end_x"), to_f("end_y")).tolist()
+    log.version += 1
+
+# ★ 保存済みの全試合のゾーン列を作り直す（終了済みのセットも含む。python zones.py [ID ...]）
+if __name__ == "__main__":
+    import sys
+    import storage
+    ids = sys.argv[1:] or [os.path.basename(p)[len("autosave_state_"):-len(".json")] for p in glob.glob("autosave_state_*.json")]
+    for gid in ids:
+        print(f"{gid}: {storage.Journal(gid).rewrite_rows(rezone)} rows")